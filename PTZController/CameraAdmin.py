@@ -0,0 +1,133 @@
+import os
+from datetime import datetime
+
+import cherrypy
+
+from .profiling import thread_dump
+
+
+class CameraAdmin(object):
+
+    def __init__(self, ptzcontroller):
+        self.ptzcontroller = ptzcontroller
+
+    @cherrypy.expose
+    def index(self):
+        return "CameraAdmin"
+
+    def _output_file(self, folder, file, default):
+        """
+        The path of an output file in a directory of the PTZController directory.
+        Only a bare file name is accepted from the request, so a request can never
+        write anywhere else.
+        """
+        if not file:
+            file = datetime.now().strftime(default)
+        elif file in ('.', '..') or any(c in file for c in '/\\:\0'):
+            raise cherrypy.HTTPError(400, 'The file must be a file name, without a directory')
+        return os.path.join(self.ptzcontroller.PROG_DIR, folder, file)
+
+    @cherrypy.expose
+    def restart(self, **kwargs):
+        self.ptzcontroller.signal('restart')
+        return "Restarting the web server"
+
+    @cherrypy.expose
+    def shutdown(self, **kwargs):
+        self.ptzcontroller.signal('shutdown')
+        return "Shutting down"
+
+    @cherrypy.expose
+    def threads(self, **kwargs):
+        cherrypy.response.headers['Content-Type'] = 'text/plain'
+        return thread_dump()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def previews(self, **kwargs):
+        return self.ptzcontroller.previews.status()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def profile_start(self, mode='sample', seconds=30, handlers=None, **kwargs):
+        """
+        Start a time-bounded capture. mode is 'sample' for stack sampling of the whole
+        process or 'cprofile' for the /control handlers, optionally limited to a comma
+        separated list of handlers.
+        """
+        handlers = [name.strip() for name in handlers.split(',') if name.strip()] if handlers else None
+        try:
+            return self.ptzcontroller.profiler.start(mode, seconds, handlers)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def profile_stop(self, **kwargs):
+        return self.ptzcontroller.profiler.stop()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def profile_status(self, **kwargs):
+        return self.ptzcontroller.profiler.status()
+
+    @cherrypy.expose
+    def profile_download(self, **kwargs):
+        profiler = self.ptzcontroller.profiler
+        collapsed = profiler.collapsed()
+        if collapsed is not None:
+            cherrypy.response.headers['Content-Type'] = 'text/plain'
+            cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="ptzcontroller.collapsed"'
+            return collapsed
+        data = profiler.pstats()
+        if data is not None:
+            cherrypy.response.headers['Content-Type'] = 'application/octet-stream'
+            cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="ptzcontroller.pstats"'
+            return data
+        raise cherrypy.NotFound()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def record_start(self, file=None, **kwargs):
+        file = self._output_file('recordings', file, 'control-%Y%m%d-%H%M%S.txt')
+        try:
+            return self.ptzcontroller.recorder.start(file)
+        except (ValueError, OSError) as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def record_stop(self, **kwargs):
+        return self.ptzcontroller.recorder.stop()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def record_status(self, **kwargs):
+        return self.ptzcontroller.recorder.status()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def trace_start(self, file=None, sample=0.1, **kwargs):
+        file = self._output_file('traces', file, 'trace-%Y%m%d-%H%M%S.jsonl')
+        try:
+            return self.ptzcontroller.tracer.start(file, sample)
+        except (ValueError, OSError) as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def trace_stop(self, **kwargs):
+        return self.ptzcontroller.tracer.stop()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def trace_status(self, **kwargs):
+        return self.ptzcontroller.tracer.status()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def trace_summary(self, clear=None, **kwargs):
+        summary = self.ptzcontroller.tracer.summary()
+        if clear:
+            self.ptzcontroller.tracer.clear()
+        return summary
@@ -1,5 +1,13 @@
+import json
+
 import cherrypy
 
+from .discovery import Discovery
+
+
+PASSWORD_PLACEHOLDER = '<set me>'
+
+
 class CameraConfig(object):
 
     def __init__(self, ptzcontroller):
@@ -9,3 +17,33 @@ class CameraConfig(object):
     def index(self):
         return "CameraConfig"
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def reload(self, **kwargs):
+        result = self.ptzcontroller.reload_config()
+        if result is None:
+            raise cherrypy.HTTPError(500, 'Unable to reload configuration')
+        return result
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def nodes(self, **kwargs):
+        return self.ptzcontroller.federation.status()
+
+    @cherrypy.expose
+    def discover(self, userid=None, password=None, refresh=None, format='json', **kwargs):
+        """
+        Discover ONVIF cameras on the network. With format=conf, config sections
+        for the cameras that are not configured yet are returned instead.
+        """
+        defaults = self.ptzcontroller.CONFIG.defaults()
+        # Only a password the client sent is returned to it, never the configured one
+        conf_password = password or PASSWORD_PLACEHOLDER
+        userid = userid or defaults.get('userid')
+        password = password or defaults.get('password')
+        devices = self.ptzcontroller.discovery.scan(userid, password, refresh=refresh in ('1', 'yes', 'true'))
+        if format == 'conf':
+            cherrypy.response.headers['Content-Type'] = 'text/plain'
+            return Discovery.config_sections(devices, userid, conf_password)
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return json.dumps(devices).encode('utf-8')
@@ -1,5 +1,13 @@
+from datetime import timedelta
+
 import cherrypy
+from cherrypy.lib.static import serve_file
+
 from . import logger
+from . import ptzoptics
+from . import tracing
+from .federation import RemoteNodeError
+from .preview import BOUNDARY
 
 
 class CameraControl(object):
@@ -16,16 +24,25 @@ class CameraControl(object):
         logger.debug("Control Request: %s %s" % (cherrypy.request.path_info.strip('/'), args))
         camera = self.ptzcontroller.get_camera(id)
         if camera and camera.isconnected:
+            tracing.camera_resolved(camera)
             return camera
         elif camera:
             logger.debug(f'Camera {camera.name} is not connected.')
         return None
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def cameras(self, local=None, **kwargs):
+        # Remote nodes ask with local=1 so federated nodes never list each other's cameras
+        cameras = self.ptzcontroller.local_cameras if local else self.ptzcontroller.cameras
+        return [{'id': camera.id, 'name': camera.name, 'connected': camera.isconnected} for camera in cameras]
+
     @cherrypy.expose
     def gotoPreset(self, camera=None, preset=None, **kwargs):
         camera = self._get_camera(camera)
         if camera:
             status = camera.goto_preset(preset)
+            self.ptzcontroller.thumbnails.capture(camera, preset)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -34,8 +51,16 @@ class CameraControl(object):
         preset_list = []
         if camera:
             presets = camera.get_presets()
+            thumbnails = self.ptzcontroller.thumbnails
             for preset in presets:
-                preset_list.append({'name': preset.Name, 'num': preset.token})
+                preset_info = {'name': preset.Name, 'num': preset.token}
+                if getattr(camera, 'remote', False):
+                    version = camera.thumbnail_version(preset.token)
+                else:
+                    version = thumbnails.version(camera, preset.token)
+                if version:
+                    preset_info['thumbnail'] = f'{cherrypy.request.script_name}/preset_thumbnail?camera={camera.id}&preset={preset.token}&v={version}'
+                preset_list.append(preset_info)
         return sorted(preset_list, key=lambda key: int(key['num']))
 
     @cherrypy.expose
@@ -44,8 +69,44 @@ class CameraControl(object):
         camera = self._get_camera(camera)
         if camera and preset:
             camera.set_preset(preset_token=preset, preset_name=preset)
+            self.ptzcontroller.thumbnails.capture(camera, preset, delay=0)
+
+    @cherrypy.expose
+    def preset_thumbnail(self, camera=None, preset=None, **kwargs):
+        # Thumbnails are served from the cache only, never from the camera.
+        # The URL carries the thumbnail version, so it can be cached for a long time.
+        camera = self.ptzcontroller.get_camera(camera)
+        if camera and preset and getattr(camera, 'remote', False):
+            # Passed on from the node that took it
+            try:
+                data = camera.get_thumbnail(preset, kwargs.get('v'))
+            except RemoteNodeError:
+                raise cherrypy.NotFound()
+            cherrypy.response.headers['Content-Type'] = 'image/jpeg'
+            cherrypy.response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return data
+        thumbnail = self.ptzcontroller.thumbnails.get(camera, preset) if camera and preset else None
+        if thumbnail is None:
+            raise cherrypy.NotFound()
+        cherrypy.response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return serve_file(thumbnail[0], content_type='image/jpeg')
 
 
+    @cherrypy.expose
+    def preview(self, camera=None, **kwargs):
+        camera = self._get_camera(camera)
+        if not camera:
+            raise cherrypy.NotFound()
+        stream = self.ptzcontroller.previews.open(camera)
+        if stream is None:
+            raise cherrypy.HTTPError(503, 'Too many preview viewers')
+        cherrypy.response.headers['Content-Type'] = f'multipart/x-mixed-replace; boundary={BOUNDARY}'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache, no-store'
+        return stream
+    # Stream the frames as they arrive and keep the endless preview out of recordings and traces
+    preview._cp_config = {'response.stream': True, 'tools.recorder.on': False, 'tools.tracer.on': False,
+                          'tools.sessions.on': False}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def remove_preset(self, camera=None, preset=None, **kwargs):
@@ -64,16 +125,119 @@ class CameraControl(object):
 
 
     @cherrypy.expose
-    def move(self, camera=None, pan=0, tilt=0, zoom=0, velocity=None, **kwargs):
+    def move(self, camera=None, pan=0, tilt=0, zoom=0, velocity=None, timeout=None, **kwargs):
+        camera = self._get_camera(camera)
+        if camera:
+            if timeout is not None:
+                timeout = timedelta(seconds=float(timeout))
+            camera.move_continuous((pan, tilt, zoom), timeout=timeout)
+
+    @cherrypy.expose
+    def move_absolute(self, camera=None, pan=None, tilt=None, zoom=None, speed=1.0, **kwargs):
+        camera = self._get_camera(camera)
+        if camera:
+            camera.move_absolute((pan, tilt, zoom), ptz_velocity=(speed, speed, speed))
+
+    @cherrypy.expose
+    def move_relative(self, camera=None, pan=None, tilt=None, zoom=None, speed=1.0, **kwargs):
+        camera = self._get_camera(camera)
+        if camera:
+            camera.move_relative((pan, tilt, zoom), ptz_velocity=(speed, speed, speed))
+
+    @cherrypy.expose
+    def nudge(self, camera=None, pan=0, tilt=0, zoom=0, speed=1.0, **kwargs):
+        """ Move by a fraction of the field of view, such as pan=0.05, as one camera command """
+        camera = self._get_camera(camera)
+        if camera:
+            camera.nudge(pan, tilt, zoom, speed=float(speed))
+
+    @cherrypy.expose
+    def center(self, camera=None, x=0.5, y=0.5, speed=1.0, **kwargs):
+        """ Center the view on the point x, y of the image, as fractions from its top left corner """
         camera = self._get_camera(camera)
         if camera:
-            camera.move_continuous((pan, tilt, zoom))
+            camera.center_on(x, y, speed=float(speed))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def get_position(self, camera=None, **kwargs):
+        camera = self._get_camera(camera)
+        if camera:
+            pan, tilt, zoom = camera.get_position()
+            return {'pan': pan, 'tilt': tilt, 'zoom': zoom}
+
+    """
+    Server-side presets, stored as absolute positions and recalled with AbsoluteMove
+    """
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def positions(self, camera=None, **kwargs):
+        camera = self.ptzcontroller.get_camera(camera)
+        if camera:
+            return self.ptzcontroller.presets.list(camera)
+        return []
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def save_position(self, camera=None, name=None, **kwargs):
+        camera = self._get_camera(camera)
+        if camera and name:
+            position = camera.get_position()
+            self.ptzcontroller.presets.save(camera, name, position)
+            return {'name': name, 'pan': position[0], 'tilt': position[1], 'zoom': position[2]}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def recall_position(self, camera=None, name=None, speed=1.0, **kwargs):
+        camera = self._get_camera(camera)
+        if camera and name:
+            position = self.ptzcontroller.presets.get(camera, name)
+            if position is None:
+                raise cherrypy.NotFound()
+            camera.move_absolute(position, ptz_velocity=(speed, speed, speed))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def delete_position(self, camera=None, name=None, **kwargs):
+        camera = self.ptzcontroller.get_camera(camera)
+        if camera and name:
+            return self.ptzcontroller.presets.delete(camera, name)
+        return False
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def export_positions(self, camera=None, **kwargs):
+        if camera is not None:
+            camera = self.ptzcontroller.get_camera(camera)
+            if camera is None:
+                raise cherrypy.NotFound()
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="positions.json"'
+        return self.ptzcontroller.presets.export(camera)
 
     @cherrypy.expose
-    def stop(self, camera=None, **kwargs):
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    def import_positions(self, camera=None, replace=None, **kwargs):
+        """
+        Import a JSON list of positions as returned by export_positions. With camera,
+        all positions are imported into that camera.
+        """
+        if camera is not None:
+            camera = self.ptzcontroller.get_camera(camera)
+            if camera is None:
+                raise cherrypy.NotFound()
+        try:
+            count = self.ptzcontroller.presets.import_(cherrypy.request.json, camera=camera,
+                                                       replace=replace in ('1', 'yes', 'true'))
+        except (KeyError, TypeError, ValueError) as e:
+            raise cherrypy.HTTPError(400, f'Invalid positions: {e}')
+        return {'imported': count}
+
+    @cherrypy.expose
+    def stop(self, camera=None, pantilt='1', zoom='1', **kwargs):
         camera = self._get_camera(camera)
         if camera:
-            camera.stop()
+            camera.stop(pan_tilt=pantilt != '0', zoom=zoom != '0')
 
     @cherrypy.expose
     def home(self, camera=None, **kwargs):
@@ -96,48 +260,65 @@ class CameraControl(object):
 
 
     """
-    Process commands from PTZOptics OBS Dockable Plugin
+    Process the PTZOptics HTTP-CGI commands of the PTZOptics OBS Dockable Plugin and other controllers
     """
-    @cherrypy.expose
-    @cherrypy.tools.json_out()
-    def param_cgi(self, camera=None, preset=None, **kwargs):
-        logger.info("param: %s" % kwargs)
-        return "CameraControl param"
+    @staticmethod
+    def _cgi_args():
+        # The commands are positional, such as ptzcmd&left&12&10. Named parameters such as camera=1 are skipped.
+        return [arg for arg in cherrypy.request.query_string.split('&') if arg and '=' not in arg]
 
+    @cherrypy.expose
+    def param_cgi(self, camera=1, **kwargs):
+        camera = self._get_camera(camera)
+        if camera:
+            for param, value in ptzoptics.parse_param(self._cgi_args()):
+                # Settings the camera does not support are skipped like unknown commands
+                if getattr(camera, f'set_{param}')(value) is False:
+                    logger.debug(f'Unsupported param.cgi setting on Camera {camera.name}: {param}')
 
     @cherrypy.expose
     def ptzctrl_cgi(self, camera=1, **kwargs):
-        args = cherrypy.request.query_string.split('&')
-
-        if args[0] != 'ptzcmd':
+        args = self._cgi_args()
+        if not args or args[0] != 'ptzcmd':
+            return
+        camera = self._get_camera(camera)
+        if not camera:
             return
 
-        if args[1] == 'poscall':
-            status = self.gotoPreset(camera, int(args[2]) - 1)
-        elif args[1] == 'right':
-            status = self.move(camera=camera, pan=-int(int(args[2])/20), tilt=0, zoom=0)
-        elif args[1] == 'left':
-            status = self.move(camera=camera, pan=int(int(args[2])/20), tilt=0, zoom=0)
-        elif args[1] == 'up':
-            status = self.move(camera=camera, pan=0, tilt=-int(int(args[2])/15), zoom=0)
-        elif args[1] == 'down':
-            status = self.move(camera=camera, pan=0, tilt=int(int(args[2])/15), zoom=0)
-        elif args[1] == 'zoomin':
-            status = self.move(camera=camera, pan=0, tilt=0, zoom=int(int(args[2])/7))
-        elif args[1] == 'zoomout':
-            status = self.move(camera=camera, pan=0, tilt=0, zoom=-int(int(args[2])/7))
-        elif args[1] == 'zoomstop':
-            status = self.stop(camera)
-        elif args[1] == 'ptzstop':
-            status = self.stop(camera)
-        elif args[1] == 'focusin':
-            status = self.focus(camera, speed=int(int(args[2])/7))
-        elif args[1] == 'focusout':
-            status = self.focus(camera, speed=-int(int(args[2])/7))
-        elif args[1] == 'focusstop':
-            status = self.focusstop(camera)
-        elif args[1] == 'home':
-            status = self.home(camera)
-        else:
-            logger.debug("Unrecogized ptzctrl.ptzcmd: %s" % cherrypy.request.query_string)
+        command = ptzoptics.parse_ptzcmd(args)
+        if command.unknown:
+            logger.debug(f'Unrecognized ptzctrl.cgi commands: {command.unknown}')
+
+        # All the pan, tilt and zoom commands of the query are one move or one stop
+        velocity = command.velocity
+        if velocity is not None:
+            camera.move_continuous(velocity)
+        elif command.stop_pantilt or command.stop_zoom:
+            camera.stop(pan_tilt=command.stop_pantilt, zoom=command.stop_zoom)
+
+        if command.focus is not None:
+            camera.set_focus_mode(mode="MANUAL")
+            camera.move_focus_continuous(speed=command.focus)
+        elif command.focus_stop:
+            camera.stop_focus()
+
+        if command.home:
+            camera.go_home()
+
+        for action, preset in command.presets:
+            if action == 'call':
+                camera.goto_preset(preset)
+                self.ptzcontroller.thumbnails.capture(camera, preset)
+            elif action == 'set':
+                camera.set_preset(preset_token=preset, preset_name=preset)
+                self.ptzcontroller.thumbnails.capture(camera, preset, delay=0)
+            else:
+                camera.remove_preset(preset_token=preset)
+
+        if command.position is not None:
+            kind, position, speed = command.position
+            if kind == 'absolute':
+                camera.move_absolute(position, ptz_velocity=speed)
+            else:
+                camera.move_relative(position, ptz_velocity=speed)
 
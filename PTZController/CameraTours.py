@@ -0,0 +1,56 @@
+import cherrypy
+
+from .tours import TourError
+
+
+class CameraTours(object):
+
+    def __init__(self, ptzcontroller):
+        self.ptzcontroller = ptzcontroller
+
+    @property
+    def scheduler(self):
+        return self.ptzcontroller.tours
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def index(self):
+        return sorted(self.scheduler.tours)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def status(self, **kwargs):
+        return self.scheduler.status()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def start(self, tour=None, **kwargs):
+        return self._call(self.scheduler.start, tour)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def stop(self, tour=None, **kwargs):
+        return self._call(self.scheduler.stop, tour)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def pause(self, tour=None, **kwargs):
+        return self._call(self.scheduler.pause, tour)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def resume(self, tour=None, **kwargs):
+        return self._call(self.scheduler.resume, tour)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def reload(self, **kwargs):
+        if not self.scheduler.load():
+            raise cherrypy.HTTPError(500, 'Unable to load tours')
+        return sorted(self.scheduler.tours)
+
+    def _call(self, method, tour):
+        try:
+            return method(tour)
+        except TourError as e:
+            raise cherrypy.HTTPError(400, str(e))
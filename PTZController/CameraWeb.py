@@ -37,8 +37,10 @@ class CameraWeb(object):
         cache_param = self.cache_param + '.' +  datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
         try:
             template = self._hplookup.get_template(templatename)
+            async_server = self.ptzcontroller.async_server
             return template.render(http_root=self.http_root,
                                    server_name=self.server_name,
+                                   async_port=async_server.port if async_server else 0,
                                    cache_param=cache_param,
                                    **kwargs)
         except:
@@ -1,5 +1,9 @@
 import os
 import sys
+import threading
+import time
+from collections import deque
+from configparser import Error as ConfigError
 
 try:
     import webbrowser
@@ -12,7 +16,20 @@ import cherrypy
 from . import logger
 from .config import Config
 from .camera import Camera
-from . import CameraWeb, CameraConfig, CameraControl
+from .tours import TourScheduler
+from .thumbnails import ThumbnailCache
+from .discovery import Discovery
+from .workers import CameraWorkerPool
+from .federation import Federation
+from .preview import PreviewManager
+from .asyncserver import AsyncControlServer
+from .power import PowerManager
+from .presets import PresetStore
+from .sessions import SessionCache
+from .profiling import Profiler
+from .recorder import Recorder
+from .tracing import Tracer, TraceTool
+from . import CameraWeb, CameraConfig, CameraControl, CameraTours, CameraAdmin, tours, federation, presets, sessions, tracing
 
 
 
@@ -23,10 +40,10 @@ class PTZController(object):
     SYS_LANGUAGE = None
     SYS_ENCODING = None
     ARGS = None
-    SIGNAL = None
     CONFIG = None
     VERBOSE = False
     QUIET = False
+    RESERVED_SECTIONS = ('General', 'Webserver')
 
     def __init__(self, args):
         self.ARGS = args
@@ -52,23 +69,109 @@ class PTZController(object):
                 sys.stderr.write("Unable to create the log directory. Logging to screen only.\n")
 
         logger.initLogger(console=not self.QUIET, log_dir=log_dir if log_writable else None, verbose=self.VERBOSE)
+        self._log_dir = log_dir if log_writable else None
 
         logger.info("PTZController Initializing")
 
         # Initialize the camera configurations
+        self._reload_lock = threading.RLock()
         self.initialize_cameras()
+        self.federation = Federation(self)
+        self.federation.configure(self.node_sections())
+        self.start_config_watch()
+
+        # Initialize the tour scheduler
+        tours_file = self.CONFIG.get('General', 'tours_file', fallback=None)
+        if not tours_file:
+            tours_file = os.path.join(self.PROG_DIR, tours.FILENAME)
+        self.tours = TourScheduler(self, tours_file)
+
+        # Initialize the preset thumbnail cache
+        thumbnail_dir = self.CONFIG.get('General', 'thumbnail_dir', fallback=None)
+        if not thumbnail_dir:
+            thumbnail_dir = os.path.join(self.PROG_DIR, 'cache', 'thumbnails')
+        self.thumbnails = ThumbnailCache(thumbnail_dir,
+                                         self.CONFIG.getint('General', 'thumbnail_cache_size', fallback=50) * 1024 * 1024,
+                                         width=self.CONFIG.getint('General', 'thumbnail_width', fallback=320),
+                                         delay=self.CONFIG.getfloat('General', 'thumbnail_delay', fallback=3))
+
+        # Initialize the live previews
+        # Leave server threads for the commands however many browsers show the preview
+        thread_pool = self.CONFIG.getint('Webserver', 'thread_pool', fallback=10)
+        self.previews = PreviewManager(fps=self.CONFIG.getfloat('General', 'preview_fps', fallback=5),
+                                       idle_timeout=self.CONFIG.getfloat('General', 'preview_idle_timeout', fallback=10),
+                                       max_viewers=self.CONFIG.getint('General', 'preview_max_viewers',
+                                                                      fallback=max(1, thread_pool // 2)))
+
+        # Initialize the preset database
+        preset_db = self.CONFIG.get('General', 'preset_db', fallback=None)
+        if not preset_db:
+            preset_db = os.path.join(self.PROG_DIR, presets.FILENAME)
+        self.presets = PresetStore(preset_db)
+
+        self.profiler = Profiler()
+
+        # Initialize the control command recorder
+        self.recorder = Recorder()
+        cherrypy.tools.recorder = cherrypy.Tool('on_start_resource', self.recorder.record)
+        record_file = self.CONFIG.get('General', 'record_file', fallback=None)
+        if record_file:
+            self.recorder.start(record_file)
+
+        # Initialize the command latency tracer
+        self.tracer = Tracer()
+        cherrypy.tools.tracer = TraceTool(self.tracer)
+        trace_file = self.CONFIG.get('General', 'trace_file', fallback=None)
+        if trace_file:
+            try:
+                self.tracer.start(trace_file, self.CONFIG.getfloat('General', 'trace_sample', fallback=0.1))
+            except (ValueError, OSError) as e:
+                logger.error(f'Unable to trace to {trace_file}: {e}')
+
+        # Initialize camera discovery
+        self.discovery = Discovery(self, timeout=self.CONFIG.getfloat('General', 'discovery_timeout', fallback=3))
 
         # Initialize the WebServer
+        self.wakeup = threading.Event()
+        # The signals waiting for the main loop. Appending to a deque is safe
+        # from signal handlers, which must not touch wakeup.
+        self.signals = deque()
+        port = self.start_webserver()
+
+        if self.CONFIG.getboolean('General', 'launch_browser', fallback=True) and not args.nolaunch and not no_browser:
+            host = 'localhost'
+            root = '/'
+            protocol = 'http'
+            try:
+                webbrowser.open('%s://%s:%i%s' % (protocol, host, port, root))
+            except Exception as e:
+                logger.error("Could not launch browser: %s" % e)
+
+        logger.info("PTZController Initialization Complete")
+
+    @property
+    def local_cameras(self):
+        return self._cameras
+
+    @property
+    def cameras(self):
+        if not self.federation.nodes:
+            return self._cameras
+        return sorted(self._cameras + self.federation.cameras, key=lambda camera: camera.id)
+
+    def start_webserver(self):
+        """ Mount the web applications and start the web server. Returns the port it listens on. """
         options = {
             'log.screen': False,
             'log.access_file': '',
             'log.error_file': '',
-            'server.thread_pool': 10,
         }
 
-        options['server.socket_port'] = self.CONFIG.getint('Webserver', 'server_port', fallback=8080)
-        if self.CONFIG.getboolean('Webserver', 'remote', fallback=False):
-            options['server.socket_host'] = '0.0.0.0'
+        # Every preview viewer holds a server thread for as long as it watches
+        options['server.thread_pool'] = self.CONFIG.getint('Webserver', 'thread_pool', fallback=10)
+
+        options['server.socket_port'] = self.ARGS.port or self.CONFIG.getint('Webserver', 'server_port', fallback=8080)
+        options['server.socket_host'] = '0.0.0.0' if self.CONFIG.getboolean('Webserver', 'remote', fallback=False) else '127.0.0.1'
 
         cherrypy.config.update(options)
 
@@ -137,57 +240,217 @@ class PTZController(object):
 
         cherrypy.tree.mount(CameraWeb.CameraWeb(self), '/', config=conf)
         cherrypy.tree.mount(CameraConfig.CameraConfig(self), '/config', config=conf)
-        cherrypy.tree.mount(CameraControl.CameraControl(self), '/control', config=conf)
-        cherrypy.tree.mount(CameraControl.CameraControl(self), '/cgi-bin', config=conf)
+        control_conf = dict(conf)
+        control_conf['/'] = dict(conf['/'], **{'tools.recorder.on': True, 'tools.tracer.on': True})
+
+        cherrypy.tree.mount(CameraControl.CameraControl(self), '/control', config=control_conf)
+        cherrypy.tree.mount(CameraControl.CameraControl(self), '/cgi-bin', config=control_conf)
+        cherrypy.tree.mount(CameraTours.CameraTours(self), '/tours', config=conf)
+        cherrypy.tree.mount(CameraAdmin.CameraAdmin(self), '/admin', config=conf)
         cherrypy.log.access_log.propagate = False
         cherrypy.server.start()
         cherrypy.server.wait()
+        tracing.watch_queue(cherrypy.server.httpserver)
 
-        if self.CONFIG.getboolean('General', 'launch_browser', fallback=True) and not args.nolaunch and not no_browser:
-            host = 'localhost'
-            port = options['server.socket_port']
-            root = '/'
-            protocol = 'http'
+        # Optionally serve the camera commands from the asyncio server as well
+        self.async_server = None
+        async_port = self.CONFIG.getint('Webserver', 'async_port', fallback=0)
+        if async_port:
+            self.async_server = AsyncControlServer(self, host=options['server.socket_host'], port=async_port,
+                                                   threads=options['server.thread_pool'])
             try:
-                webbrowser.open('%s://%s:%i%s' % (protocol, host, port, root))
-            except Exception as e:
-                logger.error("Could not launch browser: %s" % e)
+                self.async_server.start()
+            except OSError as e:
+                logger.error(f'Async control server could not listen on port {async_port}: {e}')
+                self.async_server = None
+        return options['server.socket_port']
 
-        logger.info("PTZController Initialization Complete")
+    def stop_webserver(self):
+        # End the preview streams first, they would hold their server threads
+        self.previews.stop()
+        if self.async_server:
+            self.async_server.stop()
+            self.async_server = None
+        cherrypy.server.stop()
+        # Drop the HTTP server so the next start binds to the configured address again
+        cherrypy.server.httpserver = None
+        cherrypy.tree.apps.clear()
 
-    @property
-    def cameras(self):
-        return self._cameras
+    def signal(self, name):
+        """ Ask the main loop to act on a signal such as 'shutdown', 'restart' or 'reload'. Not for signal handlers. """
+        self.signals.append(name)
+        self.wakeup.set()
 
     def shutdown(self, restart=False, update=False, checkout=False):
+        if restart:
+            # Restart the web tier in place. The camera sessions stay connected;
+            # only cameras whose configuration changed are reinitialized.
+            logger.info("Restarting the PTZController web server")
+            start = time.monotonic()
+            self.stop_webserver()
+            self.reload_config()
+            self.start_webserver()
+            logger.info(f'PTZController web server restarted in {(time.monotonic() - start) * 1000:.0f} ms')
+            return
+
         print("Stopping PTZController...")
+        self.previews.stop()
+        if self.async_server:
+            self.async_server.stop()
         cherrypy.engine.exit()
-        for camera in self._cameras:
-            if camera.isconnected and camera.power_off:
-                camera.powerOff()
+        self.tracer.stop()
+        self.power.power_off_all([camera for camera in self._cameras if camera.isconnected and camera.power_off],
+                                 timeout=self.CONFIG.getfloat('General', 'power_off_timeout', fallback=10))
+        self.power.close()
+        if self.workers:
+            self.workers.stop()
+        self.federation.stop()
         print('WebServices Terminated')
 
     def initialize_cameras(self):
+        power_options = (self.CONFIG.getfloat('General', 'power_stagger', fallback=0),
+                         self.CONFIG.getfloat('General', 'power_timeout', fallback=60))
+        self.power = PowerManager(*power_options)
+
+        # The resolved ONVIF sessions of the cameras, so they are usable right away after a restart
+        session_cache = self.CONFIG.get('General', 'session_cache', fallback=None)
+        if session_cache == 'None':
+            session_cache = None
+        elif not session_cache:
+            session_cache = os.path.join(self.PROG_DIR, 'cache', sessions.FILENAME)
+        self.sessions = SessionCache(session_cache) if session_cache else None
+
+        self.workers = None
+        worker_count = self.CONFIG.getint('General', 'workers', fallback=0)
+        if worker_count > 0:
+            self.workers = CameraWorkerPool(worker_count, console=not self.QUIET, log_dir=self._log_dir, verbose=self.VERBOSE,
+                                            power_options=power_options, session_cache=session_cache)
         self._cameras = []
-        cameraID = 1
+        self._camera_ids = {}
+        self._camera_options = {}
+        self._next_camera_id = 1
+        for section, options in self.camera_sections().items():
+            self._cameras.append(self._start_camera(section, options))
+
+    def camera_sections(self):
+        """ Return the options of every camera section in the config, keyed by section name """
+        sections = {}
         for section in self.CONFIG.sections():
-            if section in ['General', 'Webserver']:
+            if section in self.RESERVED_SECTIONS or section.startswith(federation.SECTION_PREFIX):
                 continue
             camera_options = {}
-            camera_options['id'] = cameraID
             for key, value in self.CONFIG.items(section):
                 if key == 'id':
                     continue
                 camera_options[key] = value
             if 'name' not in camera_options:
                 camera_options['name'] = section[0:12] if len(section) > 12 else section
-            self._cameras.append(Camera(camera_options))
-            cameraID += 1
+            sections[section] = camera_options
+        return sections
+
+    def node_sections(self):
+        """ Return the options of every remote node section in the config, keyed by node name """
+        sections = {}
+        for section in self.CONFIG.sections():
+            if section.startswith(federation.SECTION_PREFIX):
+                sections[section[len(federation.SECTION_PREFIX):]] = dict(self.CONFIG.items(section))
+        return sections
+
+    def allocate_camera_id(self, key):
+        """
+        Return the camera ID for a camera section name or remote camera key.
+        IDs are handed out once per key and never reused, so a camera that is
+        changed or removed and added again keeps its ID.
+        """
+        with self._reload_lock:
+            if key not in self._camera_ids:
+                self._camera_ids[key] = self._next_camera_id
+                self._next_camera_id += 1
+            return self._camera_ids[key]
+
+    def _start_camera(self, section, options):
+        self._camera_options[section] = options
+        camera_options = dict(options)
+        camera_options['id'] = self.allocate_camera_id(section)
+        if self.workers:
+            return self.workers.create_camera(camera_options)
+        return Camera(camera_options, power=self.power, sessions=self.sessions)
+
+    def reload_config(self):
+        """
+        Re-read the config file and apply the camera differences. New and
+        changed cameras are initialized, removed cameras are closed and
+        unchanged cameras stay connected.
+
+        Returns a dict with the section names that were added, changed and removed.
+        """
+        with self._reload_lock:
+            try:
+                self.CONFIG.reload()
+            except (ConfigError, OSError) as e:
+                logger.error(f'Unable to reload configuration {self.CONFIG.config_file}: {e}')
+                return None
+
+            sections = self.camera_sections()
+            running = {camera.id: camera for camera in self._cameras}
+            cameras = []
+            result = {'added': [], 'changed': [], 'removed': []}
+
+            for section, options in sections.items():
+                camera_id = self._camera_ids.get(section)
+                camera = running.pop(camera_id, None)
+                if camera is not None and self._camera_options.get(section) == options:
+                    cameras.append(camera)
+                    continue
+                if camera is not None:
+                    logger.info(f'Configuration for Camera {camera.name} changed. Reinitializing.')
+                    camera.close()
+                    result['changed'].append(section)
+                else:
+                    result['added'].append(section)
+                cameras.append(self._start_camera(section, options))
+
+            for section in list(self._camera_options):
+                if section not in sections:
+                    del self._camera_options[section]
+                    result['removed'].append(section)
+            for camera in running.values():
+                logger.info(f'Camera {camera.name} removed from configuration.')
+                camera.close()
+
+            self._cameras = sorted(cameras, key=lambda camera: camera.id)
+            self.federation.configure(self.node_sections())
+            self._config_mtime = self._get_config_mtime()
+            logger.info("Configuration reloaded: %s" % result)
+            return result
+
+    def start_config_watch(self):
+        self._config_mtime = self._get_config_mtime()
+        interval = self.CONFIG.getfloat('General', 'config_watch_interval', fallback=2)
+        if interval <= 0:
+            return
+        th = threading.Thread(target=self._watch_config, args=(interval,), name="ConfigWatch", daemon=True)
+        th.start()
+
+    def _watch_config(self, interval):
+        while True:
+            time.sleep(interval)
+            mtime = self._get_config_mtime()
+            if mtime is not None and mtime != self._config_mtime:
+                logger.info(f'Configuration file {self.CONFIG.config_file} changed.')
+                self._config_mtime = mtime
+                self.reload_config()
+
+    def _get_config_mtime(self):
+        try:
+            return os.path.getmtime(self.CONFIG.config_file)
+        except OSError:
+            return None
 
     def get_camera(self, id=None):
         try:
             id = int(id)
-            for camera in self._cameras:
+            for camera in self.cameras:
                 if camera.id == id:
                     return camera
         except (TypeError, ValueError):
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote
+
+import cherrypy
+from cherrypy import _cprequest, _httputil
+
+from . import logger
+from . import tracing
+
+
+MOUNTS = ('/control', '/cgi-bin')
+ROUTES = ('move', 'stop', 'home', 'focus', 'focusstop', 'gotoPreset', 'get_presets', 'nudge', 'center', 'ptzctrl_cgi',
+          'param_cgi')
+MAX_HEADER_BYTES = 16384
+KEEPALIVE_TIMEOUT = 60
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class AsyncControlServer(object):
+    """
+    An asyncio HTTP server for the camera commands of the /control and
+    /cgi-bin mounts.
+
+    Connections are kept alive and their requests are answered in order.
+    Each command calls the handler of the mounted CameraControl application
+    on a thread pool, without the CherryPy request pipeline: no sessions,
+    gzip or encoding tools run. The pages and all other routes stay on the
+    CherryPy server.
+    """
+
+    def __init__(self, ptzcontroller, host='127.0.0.1', port=8081, threads=10):
+        self.ptzcontroller = ptzcontroller
+        self.host = host
+        self.port = port
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='AsyncControl')
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._started = threading.Event()
+        self._error = None
+        self._writers = set()
+        self._thread = threading.Thread(target=self._run, name='AsyncControlServer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+        if self._error:
+            raise self._error
+        logger.info(f'Async control server listening on {self.host}:{self.port}')
+
+    def stop(self):
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._client, self.host, self.port, limit=MAX_HEADER_BYTES))
+        except OSError as e:
+            self._error = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            # Closing the connections ends their tasks once any command in progress is answered
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            tasks = asyncio.all_tasks(self._loop)
+            if tasks:
+                self._loop.run_until_complete(asyncio.wait(tasks, timeout=5))
+            self._loop.close()
+
+    async def _client(self, reader, writer):
+        remote = writer.get_extra_info('peername') or ('', 0)
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                received = time.time()
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self._respond(writer, 400, b'', 'text/plain', False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+                if method not in ('GET', 'POST'):
+                    status, body, content_type = 405, b'', 'text/plain'
+                else:
+                    status, body, content_type = await self._loop.run_in_executor(
+                        self._executor, self._call, target, remote, received)
+                await self._respond(writer, status, body, content_type, keep_alive, version)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer, status, body, content_type, keep_alive, version='HTTP/1.1'):
+        head = (f'{version} {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Access-Control-Allow-Origin: *\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    def _call(self, target, remote, received=None):
+        """ Run a control handler. Returns (status, body, content type) """
+        tracer = self.ptzcontroller.tracer
+        # The request waited for a thread of the executor since it was received
+        tracer.begin(target.partition('?')[0], time.time(), received)
+        status, body, content_type = self._handle(target, remote)
+        tracer.end(status)
+        return status, body, content_type
+
+    def _handle(self, target, remote):
+        path, _, query = target.partition('?')
+        path = unquote(path)
+        mount = next((mount for mount in MOUNTS if path.startswith(mount + '/')), None)
+        name = path[len(mount) + 1:].replace('.', '_') if mount else None
+        if name not in ROUTES:
+            return 404, b'', 'text/plain'
+        app = cherrypy.tree.apps.get(mount)
+        if app is None:
+            # The CherryPy server is restarting
+            return 503, b'', 'text/plain'
+
+        params = {}
+        for key, value in parse_qsl(query, keep_blank_values=True):
+            if key in params:
+                params[key] = params[key] + [value] if isinstance(params[key], list) else [params[key], value]
+            else:
+                params[key] = value
+        client = params.pop('t', None)
+        trace = tracing.current()
+        if trace is not None:
+            trace.dispatched = time.time()
+            self.ptzcontroller.tracer.client_time(client)
+
+        # The handlers and the recorder read the request from cherrypy.request
+        request = _cprequest.Request(_httputil.Host(self.host, self.port), _httputil.Host(remote[0], remote[1]))
+        request.app = app
+        request.script_name = mount
+        request.path_info = path[len(mount):]
+        request.query_string = query
+        cherrypy.serving.load(request, _cprequest.Response())
+        try:
+            self.ptzcontroller.recorder.record()
+            handler = getattr(app.root, name)
+            result = handler(**params)
+            if trace is not None:
+                trace.handled = time.time()
+        except cherrypy.HTTPError as e:
+            return e.status, b'', 'text/plain'
+        except Exception as e:
+            logger.error(f'Async control server: {path} failed: {e}')
+            return 500, b'', 'text/plain'
+        finally:
+            cherrypy.serving.clear()
+
+        if getattr(handler, '_cp_config', {}).get('tools.json_out.on'):
+            return 200, json.dumps(result).encode('utf-8'), 'application/json'
+        if result is None:
+            return 200, b'', 'text/html;charset=utf-8'
+        return 200, result if isinstance(result, bytes) else str(result).encode('utf-8'), 'text/html;charset=utf-8'
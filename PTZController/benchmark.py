@@ -0,0 +1,76 @@
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlparse
+
+from .replay import percentile
+
+
+def run(url, path, requests, connections, timeout=10):
+    """
+    Send requests GETs of path to url over the given number of keep-alive
+    connections, each connection sending its next request as soon as the
+    previous one is answered. Returns (elapsed seconds, latencies, errors).
+    """
+    url = urlparse(url)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def connect():
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+
+    def client(count):
+        conn = connect()
+        mine = []
+        failed = 0
+        for _ in range(count):
+            sent = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = connect()
+            mine.append(time.perf_counter() - sent)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(requests // connections + (1 if i < requests % connections else 0),))
+               for i in range(connections)]
+    start = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.perf_counter() - start, latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the CherryPy and async control servers of a running PTZController.')
+    parser.add_argument('--url', default='http://localhost:8080', help='The CherryPy server')
+    parser.add_argument('--async-url', default='http://localhost:8081', help='The async control server (Webserver async_port)')
+    parser.add_argument('--path', default='/control/stop?camera=1', help='The command to send')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per server')
+    parser.add_argument('--connections', type=int, default=8, help='Concurrent keep-alive connections')
+    args = parser.parse_args()
+
+    print(f'{args.requests} x GET {args.path} over {args.connections} connections')
+    print(f'{"":10}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for name, url in (('cherrypy', args.url), ('async', args.async_url)):
+        # Warm up the connections and the handler code paths first
+        run(url, args.path, args.connections * 10, args.connections)
+        elapsed, latencies, errors = run(url, args.path, args.requests, args.connections)
+        print(f'{name:10}{len(latencies) / elapsed:10.0f}{percentile(latencies, 50) * 1000:10.2f}'
+              f'{percentile(latencies, 99) * 1000:10.2f}{errors:8}')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 from threading import Thread
 
-from onvif import ONVIFCamera, ONVIFError
+from onvif import ONVIFError
+from onvif.definition import SERVICES
+from zeep.helpers import serialize_object
 from datetime import timedelta
-import socket
+import time
+
+import requests
+from requests.auth import HTTPDigestAuth
 
 ## MONKEY PATCH
 #def zeep_pythonvalue(self, xmlvalue):
@@ -14,11 +19,40 @@ import socket
 
 
 from . import logger
+from .preview import open_stream
+from .power import PowerManager
+from .tracing import instrument
+from .sessions import CachedONVIFCamera, normalize
+
+
+ONVIF_RETRY_SECONDS = 5
+# The services whose addresses are kept in the session cache
+SESSION_SERVICES = ('media', 'ptz', 'imaging')
+
+# The field of view at the widest zoom, in pan and tilt relative translation units
+DEFAULT_FOV = (0.35, 0.2)
+DEFAULT_ZOOM_RATIO = 20
+# Relative translation units per second of a continuous move at full speed
+DEFAULT_RATES = (0.5, 0.5, 0.3)
+# The shortest continuous move of a timed relative move. Shorter moves are slowed down instead.
+MIN_TIMED_MOVE_SECONDS = 0.2
 
 
 class Camera(object):
-    def __init__(self, options):
+    def __init__(self, options, power=None, sessions=None):
         self.__isconnected = False
+        self.__power = power or PowerManager()
+        self.__sessions = sessions
+        self.__closed = False
+        self.__snapshot_uri = None
+        self.__focus_mode = None
+        self.__relative_spaces = None
+        # The last known zoom position, for scaling nudges without asking the camera
+        self.__zoom = None
+        self.__zoom_stale = True
+        self.__zoom_refreshing = False
+        self.__http = None
+        self.preview_uri = None
         self.id = options['id']
         self.name = options['name']
         try:
@@ -32,6 +66,11 @@ class Camera(object):
             self.port_visca = int(options['port_visca']) if 'port_visca' in options else None
             self.power_on = True if options.get('power_on') in ('yes', 'true', '0') else False
             self.power_off = True if options.get('power_off') in ('yes', 'true', '0') else False
+            self.preview_uri = options.get('preview_uri')
+            self.fov = (float(options.get('fov_pan', DEFAULT_FOV[0])), float(options.get('fov_tilt', DEFAULT_FOV[1])))
+            self.zoom_ratio = float(options.get('zoom_ratio', DEFAULT_ZOOM_RATIO))
+            self.rates = (float(options.get('pan_rate', DEFAULT_RATES[0])), float(options.get('tilt_rate', DEFAULT_RATES[1])),
+                          float(options.get('zoom_rate', DEFAULT_RATES[2])))
 
             th = Thread(target=self.__initialize, name=f"CameraInit-{self.name}")
             th.start()
@@ -41,27 +80,111 @@ class Camera(object):
 
     def __initialize(self):
         logger.info(f'Initializing Camera {self.name} at {(self.host,self.port)}')
+        cached = self.__sessions.get(self.host, self.port) if self.__sessions else None
+        if cached:
+            # Usable right away. The session is revalidated with the camera below.
+            try:
+                self.__connect(cached)
+                if not self.__closed:
+                    self.__isconnected = True
+                    logger.info(f'Camera {self.name} ready from the session cache, firmware {cached.get("firmware")}')
+            except Exception as e:
+                logger.info(f'Camera {self.name}: Cached session unusable: {e}')
+                cached = None
         try:
-            if self.power_on:
-                self.powerON()
-            self.__cam = ONVIFCamera(self.host, self.port, self.__userid, self.__password)
-            self.__media_service = self.__cam.create_media_service()
-            self.__ptz_service = self.__cam.create_ptz_service()
-            self.__imaging_service = self.__cam.create_imaging_service()
-            self.__profile = self.__media_service.GetProfiles()[0]
-            self.__video_source = self.__get_video_sources()[0]
-            self.__ptz_status = self.__ptz_service.GetStatus({'ProfileToken': self.__profile.token})
-            self.capabilities = self.__get_service_capabilities()
+            deadline = time.monotonic()
+            if self.power_on and self.powerON():
+                # The camera is on, but its ONVIF service may still be starting
+                deadline += self.__power.timeout
+            while True:
+                try:
+                    cam = CachedONVIFCamera(self.host, self.port, self.__userid, self.__password)
+                    state = self.__resolve(cam)
+                    break
+                except Exception as e:
+                    if self.__closed or time.monotonic() >= deadline:
+                        raise
+                    logger.debug(f'Camera {self.name}: ONVIF not ready yet: {e}')
+                    time.sleep(ONVIF_RETRY_SECONDS)
+            if self.__closed:
+                logger.info(f'Camera {self.name} was removed during initialization. Not Connected')
+                return
+            if state != cached:
+                if cached:
+                    logger.info(f'Camera {self.name}: The cached session no longer matches the camera. Reconnecting.')
+                self.__connect(state, cam)
+                if self.__sessions:
+                    self.__sessions.put(self.host, self.port, state)
             self.__isconnected = True
             logger.info(f'Successfully Initialized Camera {self.name} at {(self.host, self.port)}')
-        except Exception as e:
+            self.__refresh_zoom()
+        except Exception:
             self.__isconnected = False
             logger.info(f'Initialization for Camera {self.name} at {(self.host, self.port)} failed. Not Connected')
 
+    def __resolve(self, cam):
+        """ Ask the camera for the session state that is cached: addresses, tokens, capabilities and firmware """
+        media_service = cam.create_media_service()
+        ptz_service = cam.create_ptz_service()
+        profile = media_service.GetProfiles()[0]
+        video_source = media_service.GetVideoSources()[0]
+        spaces = ptz_service.GetNode({'NodeToken': profile.PTZConfiguration.NodeToken}).SupportedPTZSpaces
+        state = {
+            'firmware': cam.devicemgmt.GetDeviceInformation().FirmwareVersion,
+            # The other addresses, such as that of an event subscription, are not used
+            'xaddrs': {SERVICES[name]['ns']: cam.xaddrs[SERVICES[name]['ns']] for name in SESSION_SERVICES},
+            'profile': profile.token,
+            'ptz_configuration': profile.PTZConfiguration.token,
+            'ptz_node': profile.PTZConfiguration.NodeToken,
+            'video_source': video_source.token,
+            'video_source_configuration': profile.VideoSourceConfiguration.token,
+            'capabilities': serialize_object(ptz_service.GetServiceCapabilities(), dict),
+            'relative_move': [bool(getattr(spaces, 'RelativePanTiltTranslationSpace', None)),
+                              bool(getattr(spaces, 'RelativeZoomTranslationSpace', None))],
+        }
+        return normalize(state)
+
+    def __connect(self, state, cam=None):
+        """ Create the ONVIF services for a session state. Makes no requests to the camera. """
+        if cam is None:
+            cam = CachedONVIFCamera(self.host, self.port, self.__userid, self.__password, xaddrs=state['xaddrs'])
+        media_service = cam.create_media_service()
+        ptz_service = cam.create_ptz_service()
+        imaging_service = cam.create_imaging_service()
+        instrument(media_service, ptz_service, imaging_service)
+        self.__profile_token = state['profile']
+        self.__ptz_configuration_token = state['ptz_configuration']
+        self.__ptz_node_token = state['ptz_node']
+        self.__video_source_token = state['video_source']
+        self.__video_source_configuration_token = state['video_source_configuration']
+        self.capabilities = state['capabilities']
+        self.__relative_spaces = tuple(state['relative_move']) if 'relative_move' in state else None
+        self.__cam = cam
+        self.__media_service = media_service
+        self.__ptz_service = ptz_service
+        self.__imaging_service = imaging_service
+
     @property
     def isconnected(self):
         return self.__isconnected
 
+    def close(self):
+        """
+        Disconnect the camera and release its ONVIF services. Used when the
+        camera is removed from, or changed in, the configuration.
+        """
+        logger.info(f'Camera {self.name}: Closing')
+        self.__closed = True
+        self.__isconnected = False
+        self.__cam = None
+        self.__media_service = None
+        self.__ptz_service = None
+        self.__imaging_service = None
+        if self.__http is not None:
+            self.__http.close()
+            self.__http = None
+        self.__power.release(self)
+
     @property
     def configuration(self):
         return self.__get_configurations()
@@ -71,27 +194,38 @@ class Camera(object):
         return self.__get_ptz_conf_opts()
 
     def powerON(self):
-        logger.info(f'Camera {self.name}: Powering On')
-        if self.port_visca is not None:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
-            s.connect((self.host, self.port_visca))
-            data = bytes.fromhex('8101040002FF')
-            s.send(data)
-            s.close()
-        else:
-            logger.info(f'Camera {self.name}: Cannot Power on. No VISCA port specified in configuration.')
-
+        return self.__power.power_on(self)
 
     def powerOff(self):
-        logger.info(f'Camera {self.name}: Powering Off')
+        return self.__power.power_off(self)
+
+    def set_flip(self, flip):
+        """
+        Flip the image vertically. Uses VISCA when port_visca is set, otherwise
+        the ONVIF video source rotation, which turns the image by 180 degrees.
+        """
+        logger.debug(f'Camera {self.name}: Setting flip {flip}')
         if self.port_visca is not None:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
-            s.connect((self.host, self.port_visca))
-            data = bytes.fromhex('8101040003FF')
-            s.send(data)
-            s.close()
-        else:
-            logger.info(f'Camera {self.name}: Cannot Power off. No VISCA port specified in configuration.')
+            self.__power.channel(self).send(bytes.fromhex('81010466' + ('02' if flip else '03') + 'FF'))
+            return
+        req = self.__media_service.create_type('SetVideoSourceConfiguration')
+        req.Configuration = self.__media_service.GetVideoSourceConfiguration(
+            {'ConfigurationToken': self.__video_source_configuration_token})
+        req.Configuration.Extension = {'Rotate': {'Mode': 'ON' if flip else 'OFF', 'Degree': 180}}
+        req.ForcePersistence = True
+        self.__media_service.SetVideoSourceConfiguration(req)
+
+    def set_mirror(self, mirror):
+        """
+        Mirror the image horizontally. Requires VISCA, ONVIF has no mirroring.
+        Returns False when the camera has no VISCA port.
+        """
+        logger.debug(f'Camera {self.name}: Setting mirror {mirror}')
+        if self.port_visca is None:
+            logger.info(f'Camera {self.name}: Mirroring requires a VISCA port in the configuration.')
+            return False
+        self.__power.channel(self).send(bytes.fromhex('81010461' + ('02' if mirror else '03') + 'FF'))
+        return True
 
     def get_stream_uri(self, protocol='UDP', stream='RTP-Unicast'):
         """
@@ -108,22 +242,54 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Getting stream uri {protocol} {stream}')
         req = self.__media_service.create_type('GetStreamUri')
-        req.ProfileToken = self.__profile.token
+        req.ProfileToken = self.__profile_token
         req.StreamSetup = {'Stream': stream, 'Transport': {'Protocol': protocol}}
         return self.__media_service.GetStreamUri(req)
 
+    def get_snapshot_uri(self):
+        """
+        Resolve the JPEG snapshot uri of the profile. The uri is looked up
+        once and reused for every later snapshot.
+        """
+        if self.__snapshot_uri is None:
+            logger.debug(f'Camera {self.name}: Getting snapshot uri')
+            req = self.__media_service.create_type('GetSnapshotUri')
+            req.ProfileToken = self.__profile_token
+            self.__snapshot_uri = self.__media_service.GetSnapshotUri(req).Uri
+        return self.__snapshot_uri
+
+    def get_snapshot(self, timeout=5):
+        """
+        Fetch a JPEG snapshot from the camera, using digest authentication
+        and falling back to basic authentication.
+        """
+        uri = self.get_snapshot_uri()
+        if self.__http is None:
+            self.__http = requests.Session()
+            self.__http.auth = HTTPDigestAuth(self.__userid, self.__password)
+        response = self.__http.get(uri, timeout=timeout)
+        if response.status_code == 401:
+            response = self.__http.get(uri, timeout=timeout, auth=(self.__userid, self.__password))
+        response.raise_for_status()
+        return response.content
+
+    def open_preview(self, timeout=5):
+        """ Open the MJPEG stream given as preview_uri """
+        return open_stream(self.preview_uri, self.__userid, self.__password, timeout=timeout)
+
     def get_status(self):
-        return self.__ptz_service.GetStatus({'ProfileToken': self.__profile.token})
+        return self.__ptz_service.GetStatus({'ProfileToken': self.__profile_token})
 
     def go_home(self):
         logger.debug(f'Camera {self.name}: Moving home')
         req = self.__ptz_service.create_type('GotoHomePosition')
-        req.ProfileToken = self.__profile.token
+        req.ProfileToken = self.__profile_token
         self.__ptz_service.GotoHomePosition(req)
+        self.__zoom_moved()
 
     def get_presets(self):
         logger.debug(f'Camera {self.name}: Getting presets')
-        return self.__ptz_service.GetPresets(self.__profile.token)
+        return self.__ptz_service.GetPresets(self.__profile_token)
 
     def goto_preset(self, preset_token, ptz_velocity=(1.0, 1.0, 1.0)):
         """
@@ -135,13 +301,12 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Moving to preset {preset_token}, speed={ptz_velocity}')
         req = self.__ptz_service.create_type('GotoPreset')
-        req.ProfileToken = self.__profile.token
+        req.ProfileToken = self.__profile_token
         req.PresetToken = preset_token
-        req.Speed = self.__ptz_status.Position
-        vel = req.Speed
-        vel.PanTilt.x, vel.PanTilt.y = ptz_velocity[0], ptz_velocity[1]
-        vel.Zoom.x = ptz_velocity[2]
-        return self.__ptz_service.GotoPreset(req)
+        req.Speed = self.__ptz_vector(ptz_velocity)
+        result = self.__ptz_service.GotoPreset(req)
+        self.__zoom_moved()
+        return result
 
     def set_preset(self, preset_token=None, preset_name=None):
         """
@@ -153,7 +318,7 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Setting preset {preset_token} ({preset_name})')
         req = self.__ptz_service.create_type('SetPreset')
-        req.ProfileToken = self.__profile.token
+        req.ProfileToken = self.__profile_token
         req.PresetToken = preset_token
         req.PresetName = preset_name
         return self.__ptz_service.SetPreset(req)
@@ -168,13 +333,15 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Removing preset {preset_token}')
         req = self.__ptz_service.create_type('RemovePreset')
-        req.ProfileToken = self.__profile.token
+        req.ProfileToken = self.__profile_token
         req.PresetToken = preset_token
         return self.__ptz_service.RemovePreset(req)
 
-    def stop(self):
+    def stop(self, pan_tilt=True, zoom=True):
         logger.debug(f'Camera {self.name}: Stopping movement')
-        self.__ptz_service.Stop({'ProfileToken': self.__profile.token})
+        self.__ptz_service.Stop({'ProfileToken': self.__profile_token, 'PanTilt': pan_tilt, 'Zoom': zoom})
+        if zoom:
+            self.__zoom_moved()
 
     def get_brightness(self):
         logger.debug(f'Camera {self.name}: Getting brightness')
@@ -241,10 +408,13 @@ class Camera(object):
         :param mode:
             string, can be either 'AUTO' or 'MANUAL'
         """
+        if mode == self.__focus_mode:
+            return
         logger.debug(f'Camera {self.name}: Settings focus mode')
         imaging_settings = self.__get_imaging_settings()
         imaging_settings.Focus.AutoFocusMode = mode
         self.__set_imaging_settings(imaging_settings)
+        self.__focus_mode = mode
 
     def move_focus_continuous(self, speed):
         """
@@ -253,10 +423,14 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Doing move focus continuous')
         req = self.__imaging_service.create_type('Move')
-        req.VideoSourceToken = self.__video_source.token
-        req.Focus = self.__get_move_options()
-        req.Focus.Continuous.Speed = speed
-        self.__imaging_service.Move(req)
+        req.VideoSourceToken = self.__video_source_token
+        req.Focus = {'Continuous': {'Speed': float(speed)}}
+        try:
+            self.__imaging_service.Move(req)
+        except Exception:
+            # The focus mode may have been changed on the camera
+            self.__focus_mode = None
+            raise
 
     def move_focus_absolute(self, position, speed=1):
         """
@@ -267,83 +441,189 @@ class Camera(object):
         """
         logger.debug(f'Camera {self.name}: Doing move focus absolute')
         req = self.__imaging_service.create_type('Move')
-        req.VideoSourceToken = self.__video_source.token
-        req.Focus = self.__get_move_options()
-        req.Focus.Absolute.Position = position
-        req.Focus.Absolute.Speed = speed
+        req.VideoSourceToken = self.__video_source_token
+        req.Focus = {'Absolute': {'Position': float(position), 'Speed': float(speed)}}
         self.__imaging_service.Move(req)
 
     def stop_focus(self):
         logger.debug(f'Camera {self.name}: Stopping focus')
-        self.__imaging_service.Stop(self.__video_source.token)
+        self.__imaging_service.Stop(self.__video_source_token)
 
     def move_continuous(self, ptz_velocity, timeout=None):
         """
         :param ptz_velocity:
             tuple (pan,tilt,zoom) where
-            pan tilt and zoom in range [-1,1]
+            pan tilt and zoom in range [-1,1], or None to leave that axis alone
         """
         logger.debug(f'Camera {self.name}: Continuous move {ptz_velocity} {"" if timeout is None else " for " + str(timeout)}')
         req = self.__ptz_service.create_type('ContinuousMove')
-        req.Velocity = self.__ptz_status.Position
-        req.ProfileToken = self.__profile.token
-        vel = req.Velocity
-        vel.PanTilt.x, vel.PanTilt.y = float(ptz_velocity[0]), float(ptz_velocity[1])
-        vel.Zoom.x = float(ptz_velocity[2])
-        # force default space
-        vel.PanTilt.space, vel.Zoom.space = None, None
+        req.ProfileToken = self.__profile_token
+        # Axes given as None are left out, so the camera keeps moving them as it was
+        req.Velocity = self.__ptz_vector(ptz_velocity)
         if timeout is not None:
             if type(timeout) is timedelta:
                 req.Timeout = timeout
             else:
                 raise TypeError('Camera {self.name}: timeout parameter is of datetime.timedelta type')
         self.__ptz_service.ContinuousMove(req)
+        if ptz_velocity[2]:
+            self.__zoom_moved()
 
     def move_absolute(self, ptz_position, ptz_velocity=(1.0, 1.0, 1.0)):
+        """
+        :param ptz_position:
+            tuple (pan,tilt,zoom) in the camera's generic position space,
+            pan tilt in range [-1,1] and zoom in range [0,1]
+        :param ptz_velocity:
+            tuple (pan,tilt,zoom) where
+            pan tilt and zoom in range [0,1]
+        """
         logger.debug(f'Camera {self.name}: Absolute move {ptz_position}')
-        req = self.__ptz_service.create_type['AbsoluteMove']
-        req.ProfileToken = self.__profile.token
-        pos = req.Position
-        pos.PanTilt.x, pos.PanTilt.y = ptz_position[0], ptz_position[1]
-        pos.Zoom.x = ptz_position[2]
-        vel = req.Speed
-        vel.PanTilt.x, vel.PanTilt.y = ptz_velocity[0], ptz_velocity[1]
-        vel.Zoom.x = ptz_velocity[2]
+        req = self.__ptz_service.create_type('AbsoluteMove')
+        req.ProfileToken = self.__profile_token
+        req.Position = self.__ptz_vector(ptz_position)
+        req.Speed = self.__ptz_vector(ptz_velocity)
         self.__ptz_service.AbsoluteMove(req)
+        if ptz_position[2] is not None:
+            self.__zoom_moved(float(ptz_position[2]))
 
     def move_relative(self, ptz_position, ptz_velocity=(1.0, 1.0, 1.0)):
+        """
+        :param ptz_position:
+            tuple (pan,tilt,zoom) translation where
+            pan tilt and zoom in range [-1,1]
+        :param ptz_velocity:
+            tuple (pan,tilt,zoom) where
+            pan tilt and zoom in range [0,1]
+        """
         logger.debug(f'Camera {self.name}: Relative move {ptz_position}')
-        req = self.__ptz_service.create_type['RelativeMove']
-        req.ProfileToken = self.__profile.token
-        pos = req.Translation
-        pos.PanTilt.x, pos.PanTilt.y = ptz_position[0], ptz_position[1]
-        pos.Zoom.x = ptz_position[2]
-        vel = req.Speed
-        vel.PanTilt.x, vel.PanTilt.y = ptz_velocity[0], ptz_velocity[1]
-        vel.Zoom.x = ptz_velocity[2]
+        req = self.__ptz_service.create_type('RelativeMove')
+        req.ProfileToken = self.__profile_token
+        req.Translation = self.__ptz_vector(ptz_position)
+        req.Speed = self.__ptz_vector(ptz_velocity)
         self.__ptz_service.RelativeMove(req)
+        if ptz_position[2]:
+            self.__zoom_moved()
+
+    def move_by(self, ptz_translation, speed=1.0):
+        """
+        Move by a relative translation with a single command. Uses RelativeMove,
+        or a ContinuousMove with a Timeout on cameras without RelativeMove.
+
+        :param ptz_translation:
+            tuple (pan,tilt,zoom) translation in relative translation units,
+            or None to leave that axis alone
+        """
+        pan_tilt = ptz_translation[0] is not None or ptz_translation[1] is not None
+        zoom = ptz_translation[2] is not None
+        relative = self.__get_relative_spaces()
+        if (not pan_tilt or relative[0]) and (not zoom or relative[1]):
+            self.move_relative(ptz_translation, ptz_velocity=(speed, speed, speed))
+            return
+
+        # Run the axes at speeds that make them all arrive when the timeout stops the move
+        speed = max(0.01, min(1.0, float(speed)))
+        distances = [abs(float(value)) if value is not None else 0.0 for value in ptz_translation]
+        seconds = max([distance / (rate * speed) for distance, rate in zip(distances, self.rates)] + [MIN_TIMED_MOVE_SECONDS])
+        velocity = tuple(None if value is None else float(value) / (rate * seconds)
+                         for value, rate in zip(ptz_translation, self.rates))
+        logger.debug(f'Camera {self.name}: No RelativeMove, moving {ptz_translation} with {velocity} for {seconds:.2f} seconds')
+        self.move_continuous(velocity, timeout=timedelta(seconds=seconds))
+
+    def nudge(self, pan=0, tilt=0, zoom=0, speed=1.0):
+        """
+        Move by a fraction of the current field of view, such as pan=0.05 for
+        5% of the view to the right, and zoom by a relative zoom translation.
+        """
+        pan, tilt, zoom = float(pan or 0), float(tilt or 0), float(zoom or 0)
+        translation = [None, None, zoom or None]
+        if pan or tilt:
+            # The field of view narrows as the camera zooms in
+            scale = 1.0
+            if self.zoom_ratio > 1:
+                scale += (self.zoom_ratio - 1) * max(0.0, min(1.0, self.__known_zoom()))
+            translation[0] = pan * self.fov[0] / scale
+            translation[1] = tilt * self.fov[1] / scale
+        if translation == [None, None, None]:
+            return
+        self.move_by(tuple(translation), speed)
+
+    def center_on(self, x, y, speed=1.0):
+        """
+        Center the view on a point of the image, with x and y as fractions of
+        its width and height from the top left corner.
+        """
+        self.nudge(float(x) - 0.5, 0.5 - float(y), speed=speed)
+
+    def get_position(self):
+        """
+        :return:
+            tuple (pan,tilt,zoom) of the current position
+        """
+        position = self.get_status().Position
+        self.__zoom = float(position.Zoom.x)
+        self.__zoom_stale = False
+        return (float(position.PanTilt.x), float(position.PanTilt.y), self.__zoom)
+
+    def __zoom_moved(self, zoom=None):
+        """ Note a move that changed the zoom, to the given zoom position when it is known """
+        if zoom is None:
+            self.__zoom_stale = True
+        else:
+            self.__zoom = zoom
+            self.__zoom_stale = False
 
-    def __get_move_options(self):
-        logger.debug(f'Camera {self.name}: Getting Move Options')
-        req = self.__imaging_service.create_type('GetMoveOptions')
-        req.VideoSourceToken = self.__video_source.token
-        return self.__imaging_service.GetMoveOptions(req)
+    def __known_zoom(self):
+        """
+        The last known zoom position, 0 when it is not known yet. When the zoom
+        has changed since, it is read from the camera in the background for the
+        next nudge, rather than delaying this one by a GetStatus round trip.
+        """
+        if self.__zoom_stale and not self.__zoom_refreshing:
+            self.__zoom_refreshing = True
+            Thread(target=self.__refresh_zoom, name=f'CameraZoom-{self.name}', daemon=True).start()
+        return self.__zoom if self.__zoom is not None else 0.0
+
+    def __refresh_zoom(self):
+        try:
+            self.get_position()
+        except Exception as e:
+            logger.debug(f'Camera {self.name}: Unable to read the zoom position: {e}')
+        finally:
+            self.__zoom_refreshing = False
+
+    @staticmethod
+    def __ptz_vector(values):
+        vector = {}
+        if values[0] is not None or values[1] is not None:
+            vector['PanTilt'] = {'x': float(values[0] or 0), 'y': float(values[1] or 0)}
+        if values[2] is not None:
+            vector['Zoom'] = {'x': float(values[2])}
+        return vector
+
+    def __get_relative_spaces(self):
+        """ Whether the camera supports RelativeMove, as (pan tilt, zoom) """
+        if self.__relative_spaces is None:
+            try:
+                spaces = self.__get_node(self.__ptz_node_token).SupportedPTZSpaces
+            except ONVIFError as e:
+                logger.debug(f'Camera {self.name}: Unable to get the PTZ spaces: {e}')
+                return (False, False)
+            self.__relative_spaces = (bool(getattr(spaces, 'RelativePanTiltTranslationSpace', None)),
+                                      bool(getattr(spaces, 'RelativeZoomTranslationSpace', None)))
+            logger.debug(f'Camera {self.name}: RelativeMove support (pan tilt, zoom): {self.__relative_spaces}')
+        return self.__relative_spaces
 
     def __get_options(self):
         logger.debug(f'Camera {self.name}: Getting options')
         req = self.__imaging_service.create_type('GetOptions')
-        req.VideoSourceToken = self.__video_source.token
+        req.VideoSourceToken = self.__video_source_token
         return self.__imaging_service.GetOptions(req)
 
-    def __get_video_sources(self):
-        logger.debug(f'Camera {self.name}: Getting video source configurations')
-        req = self.__media_service.create_type('GetVideoSources')
-        return self.__media_service.GetVideoSources(req)
-
     def __get_ptz_conf_opts(self):
         logger.debug(f'Camera {self.name}: Getting configuration options')
         req = self.__ptz_service.create_type('GetConfigurationOptions')
-        req.ConfigurationToken = self.__profile.PTZConfiguration.token
+        req.ConfigurationToken = self.__ptz_configuration_token
         return self.__ptz_service.GetConfigurationOptions(req)
 
     def __get_configurations(self):
@@ -360,16 +640,12 @@ class Camera(object):
     def __set_imaging_settings(self, imaging_settings):
         logger.debug(f'Camera {self.name}: Setting imaging settings')
         req = self.__imaging_service.create_type('SetImagingSettings')
-        req.VideoSourceToken = self.__video_source.token
+        req.VideoSourceToken = self.__video_source_token
         req.ImagingSettings = imaging_settings
         return self.__imaging_service.SetImagingSettings(req)
 
     def __get_imaging_settings(self):
         logger.debug(f'Camera {self.name}: Getting imaging settings')
         req = self.__imaging_service.create_type('GetImagingSettings')
-        req.VideoSourceToken = self.__video_source.token
+        req.VideoSourceToken = self.__video_source_token
         return self.__imaging_service.GetImagingSettings(req)
-
-    def __get_service_capabilities(self):
-        logger.debug(f'Camera {self.name}: Getting capabilities')
-        return self.__ptz_service.GetServiceCapabilities()
@@ -14,3 +14,22 @@ class Config(ConfigParser):
         super().__init__()
         self._config_file = config_file
         self.read(self._config_file)
+
+    @property
+    def config_file(self):
+        return self._config_file
+
+    def reload(self):
+        """
+        Re-read the config file, discarding values that are no longer present.
+        The file is parsed before anything is replaced, so a file with syntax
+        errors raises configparser.Error and leaves the current values intact.
+        """
+        with open(self._config_file, encoding='utf-8') as f:
+            text = f.read()
+        ConfigParser().read_string(text, source=self._config_file)
+
+        for section in self.sections():
+            self.remove_section(section)
+        self.defaults().clear()
+        self.read_string(text, source=self._config_file)
@@ -0,0 +1,213 @@
+import argparse
+import re
+import socket
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
+
+from onvif import ONVIFCamera
+
+from . import logger
+
+
+MULTICAST_ADDRESS = '239.255.255.250'
+MULTICAST_PORT = 3702
+
+PROBE = '''<?xml version="1.0" encoding="UTF-8"?>
+<e:Envelope xmlns:e="http://www.w3.org/2003/05/soap-envelope"
+            xmlns:w="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+            xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery"
+            xmlns:dn="http://www.onvif.org/ver10/network/wsdl">
+  <e:Header>
+    <w:MessageID>uuid:{message_id}</w:MessageID>
+    <w:To e:mustUnderstand="true">urn:schemas-xmlsoap-org:ws:2005:04:discovery</w:To>
+    <w:Action e:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2005/04/discovery/Probe</w:Action>
+  </e:Header>
+  <e:Body>
+    <d:Probe>
+      <d:Types>dn:NetworkVideoTransmitter</d:Types>
+    </d:Probe>
+  </e:Body>
+</e:Envelope>'''
+
+NS = {
+    'd': 'http://schemas.xmlsoap.org/ws/2005/04/discovery',
+    'w': 'http://schemas.xmlsoap.org/ws/2004/08/addressing',
+}
+
+PTZ_NS = 'http://www.onvif.org/ver20/ptz/wsdl'
+
+
+def probe(timeout=3.0, address=MULTICAST_ADDRESS, port=MULTICAST_PORT):
+    """
+    Send a WS-Discovery Probe and collect the ProbeMatches that arrive
+    within timeout seconds.
+
+    Returns a dict of device endpoint references, each with its list of
+    service addresses (XAddrs) and scopes.
+    """
+    message_id = uuid.uuid4()
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        s.bind(('', 0))
+        s.sendto(PROBE.format(message_id=message_id).encode('utf-8'), (address, port))
+
+        devices = {}
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            s.settimeout(remaining)
+            try:
+                data, sender = s.recvfrom(65535)
+            except socket.timeout:
+                break
+            try:
+                root = ET.fromstring(data)
+            except ET.ParseError:
+                logger.debug(f'Discovery: Ignoring invalid response from {sender[0]}')
+                continue
+            for match in root.iter('{%s}ProbeMatch' % NS['d']):
+                reference = match.findtext('w:EndpointReference/w:Address', default='', namespaces=NS).strip()
+                xaddrs = match.findtext('d:XAddrs', default='', namespaces=NS).split()
+                scopes = match.findtext('d:Scopes', default='', namespaces=NS).split()
+                if not xaddrs:
+                    continue
+                devices[reference or xaddrs[0]] = {'xaddrs': xaddrs, 'scopes': scopes}
+        return devices
+    finally:
+        s.close()
+
+
+def _scope(scopes, name):
+    for scope in scopes:
+        prefix = f'onvif://www.onvif.org/{name}/'
+        if scope.startswith(prefix):
+            return unquote(scope[len(prefix):])
+    return None
+
+
+def query(reference, xaddrs, scopes, userid=None, password=None):
+    """
+    Resolve a discovered device: its ONVIF host and port, device information
+    and whether it has a PTZ service.
+    """
+    url = urlparse(xaddrs[0])
+    device = {
+        'reference': reference,
+        'xaddr': xaddrs[0],
+        'host': url.hostname,
+        'port': url.port or 80,
+        'name': _scope(scopes, 'name'),
+        'hardware': _scope(scopes, 'hardware'),
+        'ptz': None,
+        'error': None,
+    }
+    if userid is None:
+        return device
+    try:
+        cam = ONVIFCamera(device['host'], device['port'], userid, password)
+        info = cam.devicemgmt.GetDeviceInformation()
+        device['manufacturer'] = info.Manufacturer
+        device['model'] = info.Model
+        device['firmware'] = info.FirmwareVersion
+        device['ptz'] = PTZ_NS in cam.xaddrs
+    except Exception as e:
+        device['error'] = str(e) or e.__class__.__name__
+    return device
+
+
+class Discovery(object):
+    """
+    Discovers ONVIF cameras with WS-Discovery and queries every device in
+    parallel. Results are cached for cache_ttl seconds so repeated scans and
+    config generation do not probe the network again.
+    """
+
+    def __init__(self, ptzcontroller=None, timeout=3.0, cache_ttl=300, address=MULTICAST_ADDRESS, port=MULTICAST_PORT):
+        self.ptzcontroller = ptzcontroller
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.address = address
+        self.port = port
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._scanned = None
+
+    def scan(self, userid=None, password=None, refresh=False):
+        with self._lock:
+            now = time.monotonic()
+            if refresh or self._scanned is None or now - self._scanned[0] > self.cache_ttl or self._scanned[1] != userid:
+                logger.info('Discovery: Probing for ONVIF devices')
+                found = probe(self.timeout, self.address, self.port)
+
+                # Only query devices that are new or whose cached query failed
+                pending = {reference: device for reference, device in found.items()
+                           if refresh or reference not in self._cache or self._cache[reference]['error']
+                           or self._cache[reference]['ptz'] is None}
+                with ThreadPoolExecutor(max_workers=16, thread_name_prefix='Discovery') as executor:
+                    results = executor.map(lambda item: query(item[0], item[1]['xaddrs'], item[1]['scopes'], userid, password),
+                                           pending.items())
+                    for device in results:
+                        self._cache[device['reference']] = device
+                self._scanned = (now, userid, list(found))
+                logger.info(f'Discovery: Found {len(found)} devices')
+            devices = [dict(self._cache[reference]) for reference in self._scanned[2]]
+
+        configured = set()
+        if self.ptzcontroller:
+            for options in self.ptzcontroller.camera_sections().values():
+                configured.add((options.get('host'), str(options.get('port'))))
+        for device in devices:
+            device['configured'] = (device['host'], str(device['port'])) in configured
+        return sorted(devices, key=lambda device: (device['host'], device['port']))
+
+    @staticmethod
+    def config_sections(devices, userid=None, password=None):
+        """ Return config sections, in PTZController.conf format, for the devices that are not configured yet """
+        lines = []
+        names = set()
+        for device in devices:
+            if device.get('configured') or device.get('ptz') is False:
+                continue
+            name = re.sub(r'[^A-Za-z0-9_-]', '-', device.get('name') or device.get('model') or device['host'])
+            section = name
+            count = 2
+            while section in names:
+                section = f'{name}-{count}'
+                count += 1
+            names.add(section)
+            lines.append(f'[{section}]')
+            lines.append(f'host = {device["host"]}')
+            lines.append(f'port = {device["port"]}')
+            lines.append(f'userid = {userid or "admin"}')
+            lines.append(f'password = {password or "admin"}')
+            lines.append('')
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Discover ONVIF cameras and print PTZController.conf sections for them.')
+    parser.add_argument('--userid', help='ONVIF userid used to query the cameras')
+    parser.add_argument('--password', help='ONVIF password used to query the cameras')
+    parser.add_argument('--timeout', type=float, default=3.0, help='Seconds to wait for probe responses')
+    parser.add_argument('--address', default=MULTICAST_ADDRESS, help='Address to send the probe to')
+    parser.add_argument('--port', type=int, default=MULTICAST_PORT, help='Port to send the probe to')
+    args = parser.parse_args()
+
+    discovery = Discovery(timeout=args.timeout, address=args.address, port=args.port)
+    devices = discovery.scan(args.userid, args.password)
+    for device in devices:
+        status = device['error'] or ('PTZ' if device['ptz'] else 'no PTZ' if device['ptz'] is False else 'not queried')
+        print(f'# {device["host"]}:{device["port"]} {device.get("name") or ""} ({status})')
+    print()
+    print(Discovery.config_sections(devices, args.userid, args.password))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import logger
+from .preview import open_stream
+
+
+SECTION_PREFIX = 'node:'
+
+
+class RemoteNodeError(Exception):
+    pass
+
+
+class RemoteNode(object):
+    """
+    A remote PTZController instance.
+
+    Commands are sent over a pooled keep-alive session. A health thread polls
+    the node's camera list, which also keeps the list of remote cameras
+    current.
+    """
+
+    def __init__(self, federation, name, options):
+        self.federation = federation
+        self.name = name
+        self.options = options
+        self.url = options['url'].rstrip('/')
+        self.timeout = float(options.get('timeout', 2))
+        self.poll_interval = float(options.get('poll_interval', 5))
+        self.preset_cache_ttl = float(options.get('preset_cache_ttl', 60))
+        self.healthy = False
+        self.last_seen = None
+        self.latency = None
+        self.failures = 0
+        self.cameras = {}
+
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self._stop = threading.Event()
+        th = threading.Thread(target=self._poll, name=f'RemoteNode-{name}', daemon=True)
+        th.start()
+
+    def request(self, path, **params):
+        start = time.monotonic()
+        try:
+            response = self._session.get(f'{self.url}/control/{path}', params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._failed(e)
+            raise RemoteNodeError(f'Node {self.name}: {path} failed: {e}')
+        self.latency = time.monotonic() - start
+        self.last_seen = time.time()
+        self.failures = 0
+        self.healthy = True
+        # The node answered, so an error status such as a missing thumbnail is not a node failure
+        if response.status_code >= 400:
+            raise RemoteNodeError(f'Node {self.name}: {path} failed: {response.status_code} {response.reason}')
+        return response
+
+    def stop(self):
+        self._stop.set()
+        for camera in list(self.cameras.values()):
+            camera.close()
+        self._session.close()
+
+    def status(self):
+        return {
+            'node': self.name,
+            'url': self.url,
+            'healthy': self.healthy,
+            'last_seen': self.last_seen,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'failures': self.failures,
+            'cameras': len(self.cameras),
+        }
+
+    def _failed(self, e):
+        self.failures += 1
+        if self.healthy:
+            logger.warning(f'Node {self.name} at {self.url} is not responding: {e}')
+        self.healthy = False
+
+    def _poll(self):
+        while not self._stop.is_set():
+            try:
+                cameras = self.request('cameras', local=1).json()
+                self._update_cameras(cameras)
+            except (RemoteNodeError, ValueError) as e:
+                logger.debug(f'{e}')
+            self._stop.wait(self.poll_interval)
+
+    def _update_cameras(self, cameras):
+        # Build a new dict and swap it in, as the web handlers iterate over the current one
+        current = self.cameras
+        updated = {}
+        for info in cameras:
+            remote_id = info['id']
+            camera = current.get(remote_id)
+            if camera is None:
+                camera_id = self.federation.ptzcontroller.allocate_camera_id(f'{SECTION_PREFIX}{self.name}/{remote_id}')
+                camera = RemoteCamera(self, camera_id, remote_id, info['name'])
+                logger.info(f'Node {self.name}: Added remote Camera {camera.name} as camera {camera_id}')
+            camera.name = info['name']
+            camera.remote_connected = bool(info.get('connected'))
+            updated[remote_id] = camera
+        self.cameras = updated
+        for remote_id, camera in current.items():
+            if remote_id not in updated:
+                logger.info(f'Node {self.name}: Remote Camera {camera.name} removed')
+                camera.close()
+
+
+class RemoteCamera(object):
+    """
+    A camera on a remote node. It offers the Camera methods used by the web
+    handlers and proxies each of them to the node's /control API. The node
+    takes the preset thumbnails of its cameras, which are passed on from it.
+    """
+
+    remote = True
+    power_on = False
+    power_off = False
+    port_visca = None
+
+    def __init__(self, node, camera_id, remote_id, name):
+        self.node = node
+        self.id = camera_id
+        self.remote_id = remote_id
+        self.name = name
+        self.host = node.name
+        self.port = remote_id
+        self.remote_connected = False
+        # The node holds the single upstream connection to the camera, this
+        # node holds a single connection to the node
+        self.preview_uri = f'{node.url}/control/preview?camera={remote_id}'
+        self._presets = None
+        self._closed = False
+
+    @property
+    def isconnected(self):
+        return not self._closed and self.node.healthy and self.remote_connected
+
+    def close(self):
+        self._closed = True
+
+    def _request(self, path, **params):
+        return self.node.request(path, camera=self.remote_id, **params)
+
+    def get_presets(self):
+        if self._presets is None or time.monotonic() - self._presets[0] > self.node.preset_cache_ttl:
+            presets = [SimpleNamespace(Name=preset['name'], token=preset['num'],
+                                       thumbnail_version=self._version(preset.get('thumbnail')))
+                       for preset in self._request('get_presets').json()]
+            self._presets = (time.monotonic(), presets)
+        return self._presets[1]
+
+    @staticmethod
+    def _version(thumbnail):
+        # The node's thumbnail URLs end with the thumbnail version
+        if not thumbnail:
+            return None
+        return dict(parse_qsl(urlparse(thumbnail).query)).get('v')
+
+    def thumbnail_version(self, preset_token):
+        """ The version of the node's thumbnail of a preset, from the last get_presets """
+        presets = self._presets[1] if self._presets else []
+        return next((preset.thumbnail_version for preset in presets if str(preset.token) == str(preset_token)), None)
+
+    def get_thumbnail(self, preset_token, version=None):
+        """ The node's thumbnail of a preset, as JPEG data """
+        return self._request('preset_thumbnail', preset=preset_token, v=version).content
+
+    def goto_preset(self, preset_token, ptz_velocity=(1.0, 1.0, 1.0)):
+        self._request('gotoPreset', preset=preset_token)
+
+    def set_preset(self, preset_token=None, preset_name=None):
+        self._presets = None
+        self._request('set_preset', preset=preset_token)
+
+    def remove_preset(self, preset_token=None, preset_name=None):
+        self._presets = None
+        self._request('remove_preset', preset=preset_token)
+
+    @staticmethod
+    def _axes(values):
+        # Axes given as None are left out
+        return {axis: value for axis, value in zip(('pan', 'tilt', 'zoom'), values) if value is not None}
+
+    def move_continuous(self, ptz_velocity, timeout=None):
+        params = self._axes(ptz_velocity)
+        if timeout is not None:
+            params['timeout'] = timeout.total_seconds()
+        self._request('move', **params)
+
+    def move_absolute(self, ptz_position, ptz_velocity=(1.0, 1.0, 1.0)):
+        self._request('move_absolute', speed=ptz_velocity[0], **self._axes(ptz_position))
+
+    def move_relative(self, ptz_position, ptz_velocity=(1.0, 1.0, 1.0)):
+        self._request('move_relative', speed=ptz_velocity[0], **self._axes(ptz_position))
+
+    def nudge(self, pan=0, tilt=0, zoom=0, speed=1.0):
+        # The node knows the field of view of its camera
+        self._request('nudge', pan=pan, tilt=tilt, zoom=zoom, speed=speed)
+
+    def center_on(self, x, y, speed=1.0):
+        self._request('center', x=x, y=y, speed=speed)
+
+    def get_position(self):
+        position = self._request('get_position').json()
+        return (position['pan'], position['tilt'], position['zoom'])
+
+    def stop(self, pan_tilt=True, zoom=True):
+        self._request('stop', pantilt=int(pan_tilt), zoom=int(zoom))
+
+    def go_home(self):
+        self._request('home')
+
+    def set_focus_mode(self, mode='AUTO'):
+        # The remote /control/focus handler switches to manual focus itself
+        pass
+
+    def move_focus_continuous(self, speed):
+        self._request('focus', speed=speed)
+
+    def stop_focus(self):
+        self._request('focusstop')
+
+    def open_preview(self, timeout=5):
+        return open_stream(self.preview_uri, timeout=timeout, session=self.node._session)
+
+    def set_flip(self, flip):
+        self.node.request(f'param.cgi?post_image_value&flip&{1 if flip else 0}', camera=self.remote_id)
+
+    def set_mirror(self, mirror):
+        self.node.request(f'param.cgi?post_image_value&mirror&{1 if mirror else 0}', camera=self.remote_id)
+
+    def powerON(self):
+        pass
+
+    def powerOff(self):
+        pass
+
+
+class Federation(object):
+    """ The remote PTZController nodes listed in the config as [node:Name] sections """
+
+    def __init__(self, ptzcontroller):
+        self.ptzcontroller = ptzcontroller
+        self.nodes = {}
+
+    @property
+    def cameras(self):
+        return [camera for node in list(self.nodes.values()) for camera in list(node.cameras.values())]
+
+    def configure(self, sections):
+        """ Start, restart and stop nodes so they match the {name: options} sections """
+        for name in list(self.nodes):
+            if name not in sections or sections[name] != self.nodes[name].options:
+                logger.info(f'Node {name} removed or changed')
+                self.nodes.pop(name).stop()
+        for name, options in sections.items():
+            if name in self.nodes:
+                continue
+            if 'url' not in options or not urlparse(options['url']).hostname:
+                logger.error(f'Node {name}: A url such as http://host:8080 is required.')
+                continue
+            logger.info(f'Adding node {name} at {options["url"]}')
+            self.nodes[name] = RemoteNode(self, name, options)
+
+    def status(self):
+        return [node.status() for node in self.nodes.values()]
+
+    def stop(self):
+        for node in self.nodes.values():
+            node.stop()
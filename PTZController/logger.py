@@ -22,7 +22,7 @@ logger = logging.getLogger('PTZController')
 
 
 
-def initLogger(console=False, log_dir=False, verbose=False):
+def initLogger(console=False, log_dir=False, verbose=False, filename=FILENAME):
     """
     Setup logging. Three log handlers are added:
 
@@ -54,7 +54,7 @@ def initLogger(console=False, log_dir=False, verbose=False):
         file_formatter = logging.Formatter(FORMAT, FORMAT_DATE)
 
         # Main Tautulli logger
-        filename = os.path.join(log_dir, FILENAME)
+        filename = os.path.join(log_dir, filename)
         file_handler = handlers.RotatingFileHandler(filename, maxBytes=MAX_SIZE, backupCount=MAX_FILES)
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(file_formatter)
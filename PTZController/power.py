@@ -0,0 +1,252 @@
+import socket
+import threading
+import time
+
+from . import logger
+
+
+POWER_ON = bytes.fromhex('8101040002FF')
+POWER_OFF = bytes.fromhex('8101040003FF')
+POWER_INQUIRY = bytes.fromhex('81090400FF')
+POWER_STATE_ON = 0x02
+
+VISCA_ERRORS = {0x01: 'message length error', 0x02: 'syntax error', 0x03: 'command buffer full',
+                0x04: 'command canceled', 0x05: 'no socket', 0x41: 'command not executable'}
+
+
+class ViscaError(Exception):
+    pass
+
+
+class ViscaChannel(object):
+    """
+    A VISCA over UDP connection to one camera.
+
+    The socket is kept open and commands are sent one at a time, so every
+    reply belongs to the command in flight. A command is complete when the
+    camera has sent its ACK and its completion message. Commands that get no
+    reply at all are sent again.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def release(self, camera):
+        """ Close the VISCA connection of a camera that is removed """
+        if camera.port_visca is None:
+            return
+        with self._lock:
+            channel = self._channels.pop((camera.host, camera.port_visca), None)
+        if channel is not None:
+            channel.close()
+
+    def close(self):
+        """ Close the VISCA connections of all cameras """
+        with self._lock:
+            self._close_socket()
+
+    def send(self, payload, timeout=1.0, retries=3):
+        """
+        Send a command or inquiry and wait for its completion message, which
+        for an inquiry holds the answer. Returns the completion message.
+        """
+        with self._lock:
+            for attempt in range(1, retries + 1):
+                sock = self._socket()
+                self._drain(sock)
+                try:
+                    sock.send(payload)
+                    status, reply = self._wait_reply(sock, timeout)
+                except OSError as e:
+                    # An ICMP port unreachable shows up as a refused connection
+                    self._close_socket()
+                    raise ViscaError(f'{self.host}:{self.port}: {e}')
+                if status == 'completed':
+                    return reply
+                if status == 'error':
+                    code = reply[2] if len(reply) > 2 else None
+                    if code == 0x03 and attempt < retries:
+                        time.sleep(0.1)
+                        continue
+                    raise ViscaError(f'{self.host}:{self.port}: {VISCA_ERRORS.get(code, code)}')
+                if status == 'acked':
+                    raise ViscaError(f'{self.host}:{self.port}: No completion after ACK')
+                logger.debug(f'VISCA {self.host}:{self.port}: No reply to {payload.hex()} (attempt {attempt} of {retries})')
+            raise ViscaError(f'{self.host}:{self.port}: No reply after {retries} attempts')
+
+    def _socket(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect((self.host, self.port))
+        return self._sock
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _wait_reply(self, sock, timeout):
+        """ Returns ('completed' or 'error', message), ('acked', None) or (None, None) on timeout """
+        acked = False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return ('acked' if acked else None), None
+            sock.settimeout(remaining)
+            try:
+                data = sock.recv(64)
+            except socket.timeout:
+                continue
+            for message in self._messages(data):
+                kind = message[1] & 0xF0
+                if kind == 0x40:
+                    acked = True
+                    # The completion can take a while, give it the full timeout again
+                    deadline = time.monotonic() + timeout
+                elif kind == 0x50:
+                    return 'completed', message
+                elif kind == 0x60:
+                    return 'error', message
+
+    @staticmethod
+    def _drain(sock):
+        # Drop late replies to an earlier command
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(64)
+        except (BlockingIOError, OSError):
+            pass
+        finally:
+            sock.setblocking(True)
+
+    @staticmethod
+    def _messages(data):
+        message = bytearray()
+        for byte in data:
+            message.append(byte)
+            if byte == 0xFF:
+                if len(message) >= 3:
+                    yield bytes(message)
+                message = bytearray()
+
+
+class PowerManager(object):
+    """
+    Powers cameras on and off over VISCA.
+
+    Every power on command takes a start slot, so cameras initializing
+    together are powered on stagger seconds apart to limit the inrush
+    current. Power on waits until the camera reports that it is on. Power
+    off draws no inrush current, so it is not staggered, and power_off_all
+    powers the whole fleet off concurrently within one deadline.
+    """
+
+    def __init__(self, stagger=0.0, timeout=60.0, retries=3, reply_timeout=1.0):
+        self.stagger = stagger
+        self.timeout = timeout
+        self.retries = retries
+        self.reply_timeout = reply_timeout
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._next_slot = 0
+
+    def channel(self, camera):
+        key = (camera.host, camera.port_visca)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = ViscaChannel(camera.host, camera.port_visca)
+            return channel
+
+    def _wait_for_slot(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.stagger
+        if slot > now:
+            time.sleep(slot - now)
+
+    def power_on(self, camera):
+        """ Power a camera on and wait until it reports that it is on. Returns True on success """
+        if camera.port_visca is None:
+            logger.info(f'Camera {camera.name}: Cannot Power on. No VISCA port specified in configuration.')
+            return False
+        self._wait_for_slot()
+        logger.info(f'Camera {camera.name}: Powering On')
+        channel = self.channel(camera)
+        deadline = time.monotonic() + self.timeout
+        try:
+            channel.send(POWER_ON, timeout=self.reply_timeout, retries=self.retries)
+            while time.monotonic() < deadline:
+                try:
+                    reply = channel.send(POWER_INQUIRY, timeout=self.reply_timeout, retries=1)
+                except ViscaError:
+                    # Some cameras stop answering while they start up
+                    reply = None
+                if reply is not None and len(reply) > 2 and reply[2] == POWER_STATE_ON:
+                    logger.info(f'Camera {camera.name}: Powered On')
+                    return True
+                time.sleep(1)
+            logger.warning(f'Camera {camera.name}: Not powered on after {self.timeout} seconds')
+        except ViscaError as e:
+            logger.warning(f'Camera {camera.name}: Power on failed: {e}')
+        return False
+
+    def power_off(self, camera):
+        """ Power a camera off. Returns True when the camera completed the command """
+        if camera.port_visca is None:
+            logger.info(f'Camera {camera.name}: Cannot Power off. No VISCA port specified in configuration.')
+            return False
+        logger.info(f'Camera {camera.name}: Powering Off')
+        try:
+            self.channel(camera).send(POWER_OFF, timeout=self.reply_timeout, retries=self.retries)
+            logger.info(f'Camera {camera.name}: Powered Off')
+            return True
+        except ViscaError as e:
+            logger.warning(f'Camera {camera.name}: Power off failed: {e}')
+            return False
+
+    def power_off_all(self, cameras, timeout=None):
+        """
+        Power off all the cameras concurrently. Returns once every camera is
+        done or timeout seconds have passed, whichever is first.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        results = {}
+
+        def power_off(camera):
+            results[camera.name] = camera.powerOff()
+
+        threads = []
+        for camera in cameras:
+            th = threading.Thread(target=power_off, args=(camera,), name=f'PowerOff-{camera.name}', daemon=True)
+            threads.append(th)
+            th.start()
+        for th in threads:
+            th.join(max(0, deadline - time.monotonic()))
+        pending = [camera.name for camera in cameras if camera.name not in results]
+        if pending:
+            logger.warning(f'Power off did not finish within {timeout} seconds for: {", ".join(pending)}')
+        return results
+
+    def release(self, camera):
+        """ Close the VISCA connection of a camera that is removed """
+        if camera.port_visca is None:
+            return
+        with self._lock:
+            channel = self._channels.pop((camera.host, camera.port_visca), None)
+        if channel is not None:
+            channel.close()
+
+    def close(self):
+        """ Close the VISCA connections of all cameras """
+        with self._lock:
+            channels, self._channels = self._channels, {}
+        for channel in channels.values():
+            channel.close()
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+import time
+
+from . import logger
+
+
+FILENAME = "presets.db"
+
+
+class PresetStore(object):
+    """
+    Server-side preset database.
+
+    Presets are stored as absolute pan/tilt/zoom positions in SQLite, keyed
+    by camera and name, so there is no limit on their number and recalling one
+    does not depend on the camera's own preset table. Cameras are identified
+    by host and port, so presets survive changes to camera IDs and names.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS presets (
+                                    camera TEXT NOT NULL,
+                                    name TEXT NOT NULL,
+                                    pan REAL NOT NULL,
+                                    tilt REAL NOT NULL,
+                                    zoom REAL NOT NULL,
+                                    updated REAL NOT NULL,
+                                    PRIMARY KEY (camera, name))''')
+        logger.info(f'Preset database {os.path.abspath(db_file)} opened')
+
+    @staticmethod
+    def camera_key(camera):
+        return f'{camera.host}:{camera.port}'
+
+    def save(self, camera, name, position):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO presets (camera, name, pan, tilt, zoom, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                             (self.camera_key(camera), name, position[0], position[1], position[2], time.time()))
+
+    def get(self, camera, name):
+        """ Return the (pan, tilt, zoom) position of a preset, or None if there is none """
+        with self._lock:
+            row = self._db.execute('SELECT pan, tilt, zoom FROM presets WHERE camera = ? AND name = ?',
+                                   (self.camera_key(camera), name)).fetchone()
+        return tuple(row) if row else None
+
+    def list(self, camera):
+        with self._lock:
+            rows = self._db.execute('SELECT name, pan, tilt, zoom FROM presets WHERE camera = ? ORDER BY name',
+                                    (self.camera_key(camera),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, camera, name):
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM presets WHERE camera = ? AND name = ?',
+                                    (self.camera_key(camera), name)).rowcount > 0
+
+    def export(self, camera=None):
+        """ Return the presets of one camera, or of all cameras, as a list of dicts """
+        with self._lock:
+            if camera is None:
+                rows = self._db.execute('SELECT camera, name, pan, tilt, zoom FROM presets ORDER BY camera, name').fetchall()
+            else:
+                rows = self._db.execute('SELECT camera, name, pan, tilt, zoom FROM presets WHERE camera = ? ORDER BY name',
+                                        (self.camera_key(camera),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_(self, presets, camera=None, replace=False):
+        """
+        Import a list of preset dicts as returned by export. With camera, every
+        preset is imported into that camera instead of the one it came from.
+        With replace, the existing presets of the cameras being imported into
+        are removed first.
+
+        Returns the number of presets imported.
+        """
+        now = time.time()
+        rows = []
+        for preset in presets:
+            key = self.camera_key(camera) if camera is not None else preset['camera']
+            rows.append((key, str(preset['name']), float(preset['pan']), float(preset['tilt']), float(preset['zoom']), now))
+        with self._lock, self._db:
+            if replace:
+                self._db.executemany('DELETE FROM presets WHERE camera = ?', {(row[0],) for row in rows})
+            self._db.executemany('INSERT OR REPLACE INTO presets (camera, name, pan, tilt, zoom, updated) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
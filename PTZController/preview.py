@@ -0,0 +1,312 @@
+import re
+import threading
+import time
+
+import requests
+from requests.auth import HTTPDigestAuth
+
+from . import logger
+
+
+BOUNDARY = 'ptzcontrollerframe'
+MAX_FRAME_BYTES = 8 * 1024 * 1024
+RETRY_SECONDS = 2
+# The upstream gives up, and ends its viewers' streams, after this many failures in a row
+MAX_UPSTREAM_FAILURES = 3
+
+
+def open_stream(uri, userid=None, password=None, timeout=5, session=None):
+    """
+    Open a streaming HTTP connection to an MJPEG uri, using digest
+    authentication and falling back to basic authentication.
+    """
+    session = session or requests.Session()
+    auth = HTTPDigestAuth(userid, password) if userid else None
+    response = session.get(uri, stream=True, timeout=timeout, auth=auth)
+    if response.status_code == 401 and userid:
+        response.close()
+        response = session.get(uri, stream=True, timeout=timeout, auth=(userid, password))
+    response.raise_for_status()
+    return response
+
+
+def _chunks(response, chunk_size):
+    # Hand on data as soon as it arrives, rather than once chunk_size bytes are read
+    if hasattr(response.raw, 'read1'):
+        while True:
+            chunk = response.raw.read1(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from response.iter_content(4096)
+
+
+def mjpeg_frames(response, chunk_size=65536):
+    """ Split a multipart/x-mixed-replace response into JPEG frames """
+    match = re.search(r'boundary="?([^";]+)"?', response.headers.get('Content-Type', ''))
+    boundary = match.group(1) if match else '--'
+    # Many cameras announce the boundary with its leading dashes
+    delimiter = (boundary if boundary.startswith('--') else '--' + boundary).encode('latin-1')
+    buf = bytearray()
+    for chunk in _chunks(response, chunk_size):
+        buf += chunk
+        while True:
+            start = buf.find(delimiter)
+            if start < 0:
+                if len(buf) > MAX_FRAME_BYTES:
+                    del buf[:-len(delimiter)]
+                break
+            header_end = buf.find(b'\r\n\r\n', start)
+            if header_end < 0:
+                break
+            body_start = header_end + 4
+            length = re.search(rb'content-length:\s*(\d+)', bytes(buf[start:header_end]), re.IGNORECASE)
+            if length and len(buf) >= body_start + int(length.group(1)):
+                body_end = body_start + int(length.group(1))
+                frame = bytes(buf[body_start:body_end])
+                del buf[:body_end]
+            else:
+                end = buf.find(delimiter, body_start)
+                if end < 0:
+                    if len(buf) - start > MAX_FRAME_BYTES:
+                        del buf[:body_start]
+                    break
+                frame = bytes(buf[body_start:end])
+                del buf[:end]
+                eoi = frame.rfind(b'\xff\xd9')
+                if eoi >= 0:
+                    frame = frame[:eoi + 2]
+            if frame:
+                yield frame
+
+
+class PreviewSource(object):
+    """
+    The live preview of one camera.
+
+    At most one upstream connection is held: the camera's MJPEG stream when
+    it has a preview_uri, otherwise snapshots polled at the frame rate. The
+    latest frame is kept as one immutable bytes object that every viewer
+    sends as is. A viewer always jumps to the newest frame, so a slow viewer
+    skips frames instead of delaying the others. The upstream is connected
+    when the first viewer arrives and disconnected once there have been no
+    viewers for idle_timeout seconds.
+
+    A viewer is sent the latest frame again, or an empty part before the
+    first frame, when no new frame arrived for idle_timeout seconds. Writing
+    it is how a viewer that has gone away is noticed and its server thread
+    freed. When the upstream fails MAX_UPSTREAM_FAILURES times in a row it
+    stops and the streams of its viewers end.
+    """
+
+    def __init__(self, camera, fps=5.0, idle_timeout=10.0):
+        self.camera = camera
+        self.interval = 1.0 / fps if fps > 0 else 0
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._viewers = 0
+        self._idle_since = time.monotonic()
+        self._thread = None
+        self._closed = False
+        self._connected = False
+        self._failures = 0
+        self.frames = 0
+        self.dropped = 0
+        self.upstream_errors = 0
+
+    def status(self):
+        return {'camera': self.camera.id, 'viewers': self._viewers,
+                'upstream': 'mjpeg' if getattr(self.camera, 'preview_uri', None) else 'snapshot',
+                'connected': self._connected, 'frames': self.frames, 'dropped': self.dropped,
+                'upstream_errors': self.upstream_errors}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stream(self):
+        """ Generator of multipart/x-mixed-replace parts for one viewer """
+        with self._cond:
+            if self._closed:
+                return
+            self._viewers += 1
+            if self._thread is None:
+                self._failures = 0
+                self._thread = threading.Thread(target=self._upstream, name=f'Preview-{self.camera.name}', daemon=True)
+                self._thread.start()
+            upstream = self._thread
+        try:
+            seq = 0
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed or self._thread is not upstream
+                                        or (self._frame is not None and self._seq != seq),
+                                        timeout=self.idle_timeout)
+                    if self._closed or self._thread is not upstream:
+                        return
+                    # Without a new frame, send the last one again as a keep-alive
+                    frame = self._frame or b''
+                    seq = self._seq
+                yield (f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+                       f'Content-Length: {len(frame)}\r\n\r\n').encode('latin-1')
+                yield frame
+                yield b'\r\n'
+        finally:
+            with self._cond:
+                self._viewers -= 1
+                if self._viewers == 0:
+                    self._idle_since = time.monotonic()
+
+    def _idle(self):
+        return self._closed or (self._viewers == 0 and time.monotonic() - self._idle_since >= self.idle_timeout)
+
+    def _publish(self, frame):
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._connected = True
+            self._failures = 0
+            self.frames += 1
+            self._cond.notify_all()
+
+    def _upstream(self):
+        uri = getattr(self.camera, 'preview_uri', None)
+        logger.info(f'Camera {self.camera.name}: Preview started from {"MJPEG stream" if uri else "snapshots"}')
+        while True:
+            try:
+                if uri:
+                    self._pull_mjpeg()
+                else:
+                    self._poll_snapshots()
+            except Exception as e:
+                self.upstream_errors += 1
+                logger.warning(f'Camera {self.camera.name}: Preview upstream failed: {e}')
+                with self._cond:
+                    self._connected = False
+                    self._failures += 1
+                    if self._failures < MAX_UPSTREAM_FAILURES:
+                        self._cond.wait_for(self._idle, timeout=RETRY_SECONDS)
+            with self._cond:
+                if self._failures >= MAX_UPSTREAM_FAILURES:
+                    logger.error(f'Camera {self.camera.name}: Preview upstream failed {self._failures} times, '
+                                 f'ending the preview streams')
+                if self._idle() or self._failures >= MAX_UPSTREAM_FAILURES:
+                    # Viewers arriving from now on start a new upstream thread
+                    self._thread = None
+                    self._frame = None
+                    self._connected = False
+                    self._cond.notify_all()
+                    break
+        logger.info(f'Camera {self.camera.name}: Preview stopped')
+
+    def _pull_mjpeg(self):
+        response = self.camera.open_preview()
+        try:
+            last = 0
+            for frame in mjpeg_frames(response):
+                if self._idle():
+                    return
+                now = time.monotonic()
+                if now - last < self.interval:
+                    self.dropped += 1
+                    continue
+                last = now
+                self._publish(frame)
+            raise requests.ConnectionError('The MJPEG stream ended')
+        finally:
+            response.close()
+
+    def _poll_snapshots(self):
+        while not self._idle():
+            start = time.monotonic()
+            self._publish(self.camera.get_snapshot())
+            with self._cond:
+                self._cond.wait_for(self._idle, timeout=max(0, self.interval - (time.monotonic() - start)))
+
+
+class ViewerStream(object):
+    """
+    The parts of a PreviewSource stream for one viewer, holding a viewer slot.
+    The server closes the response when the viewer leaves or the stream ends,
+    also when it has not started iterating yet, which releases the slot.
+    """
+
+    def __init__(self, parts, release):
+        self._parts = parts
+        self._release = release
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._parts)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._parts.close()
+        self._release()
+
+
+class PreviewManager(object):
+    """ The preview sources, one per camera, created when first viewed """
+
+    def __init__(self, fps=5.0, idle_timeout=10.0, max_viewers=5):
+        self.fps = fps
+        self.idle_timeout = idle_timeout
+        self.max_viewers = max_viewers
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._viewers = 0
+
+    def source(self, camera):
+        with self._lock:
+            source = self._sources.get(camera.id)
+            if source is None or source.camera is not camera:
+                # The camera was reconfigured. Its viewers reconnect to the new one.
+                if source is not None:
+                    source.close()
+                source = PreviewSource(camera, fps=self.fps, idle_timeout=self.idle_timeout)
+                self._sources[camera.id] = source
+            return source
+
+    def status(self):
+        with self._lock:
+            return [source.status() for source in self._sources.values()]
+
+    def open(self, camera):
+        """
+        Reserve a viewer slot and return the stream of the camera's preview
+        for the viewer, or None when all max_viewers slots are taken. The slot
+        is released when the stream is closed or ends.
+        """
+        with self._lock:
+            if self._viewers >= self.max_viewers:
+                return None
+            self._viewers += 1
+        try:
+            return ViewerStream(self.source(camera).stream(), self._release)
+        except Exception:
+            self._release()
+            raise
+
+    def _release(self):
+        with self._lock:
+            self._viewers -= 1
+
+    def stop(self):
+        """ End all viewer streams and upstream connections """
+        with self._lock:
+            sources, self._sources = self._sources, {}
+        for source in sources.values():
+            source.close()
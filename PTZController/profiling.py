@@ -0,0 +1,193 @@
+import collections
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import cherrypy
+
+from . import logger
+
+
+MAX_SECONDS = 600
+CONTROL_MOUNTS = ('/control', '/cgi-bin')
+
+
+def thread_dump():
+    """ Return the current stack of every thread as text """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f'Thread {names.get(ident, "unknown")} ({ident}):')
+        lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+class Profiler(object):
+    """
+    On-demand, time-bounded profiling of the running process.
+
+    mode 'sample' samples the stacks of all threads at a fixed interval and
+    produces collapsed stacks for flame graph tools. mode 'cprofile' runs
+    cProfile around the selected /control handlers and produces pstats.
+    Only one cProfile profiler can be active in a process, so during a
+    cprofile capture the selected handlers run one at a time.
+
+    Nothing is installed while the profiler is off: the handlers are wrapped
+    only while a cProfile capture runs, and the sampler thread only exists
+    while sampling.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = None
+        self._stop = threading.Event()
+        self._timer = None
+        self._sampler = None
+        self._wrapped = []
+        self._samples = collections.Counter()
+        self._profile = None
+        self._calls = 0
+        self._profile_lock = threading.Lock()
+        self._result = None
+
+    def start(self, mode='sample', seconds=30, handlers=None):
+        seconds = min(float(seconds), MAX_SECONDS)
+        with self._lock:
+            if self._running:
+                raise ValueError(f'A {self._running["mode"]} capture is already running')
+            if mode == 'sample':
+                self._samples = collections.Counter()
+                self._stop.clear()
+                self._sampler = threading.Thread(target=self._sample, name="ProfileSampler", daemon=True)
+                self._sampler.start()
+            elif mode == 'cprofile':
+                self._profile = cProfile.Profile()
+                self._calls = 0
+                try:
+                    self._wrap_handlers(handlers)
+                except ValueError:
+                    self._unwrap_handlers()
+                    raise
+            else:
+                raise ValueError(f'Unknown profile mode: {mode}')
+            self._running = {'mode': mode, 'started': time.time(), 'seconds': seconds,
+                             'handlers': sorted({name for root, name in self._wrapped})}
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.name = "ProfileTimer"
+            self._timer.daemon = True
+            self._timer.start()
+        logger.info(f'Profiler: {mode} capture started for {seconds} seconds')
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            if not self._running:
+                return self.status()
+            mode = self._running['mode']
+            self._timer.cancel()
+            if mode == 'sample':
+                self._stop.set()
+                # The sampler may be adding a sample to the counter
+                self._sampler.join(5)
+                self._sampler = None
+                self._result = {'mode': mode, 'samples': self._samples}
+            else:
+                self._unwrap_handlers()
+                # Wait for the handlers that are being profiled
+                with self._profile_lock:
+                    stats = pstats.Stats(self._profile) if self._calls else None
+                    self._result = {'mode': mode, 'stats': stats, 'calls': self._calls}
+                    self._profile = None
+            self._result['started'] = self._running['started']
+            self._result['stopped'] = time.time()
+            self._running = None
+        logger.info(f'Profiler: {mode} capture stopped')
+        return self.status()
+
+    def status(self):
+        status = {'running': dict(self._running) if self._running else None, 'result': None}
+        result = self._result
+        if result:
+            status['result'] = {'mode': result['mode'],
+                                'seconds': round(result['stopped'] - result['started'], 3),
+                                'samples': sum(result['samples'].values()) if result['mode'] == 'sample' else None,
+                                'calls': result['calls'] if result['mode'] == 'cprofile' else None}
+        return status
+
+    def collapsed(self):
+        """ Return the sampled stacks in collapsed format, one 'frame;frame;frame count' line per stack """
+        result = self._result
+        if not result or result['mode'] != 'sample':
+            return None
+        return ''.join(f'{stack} {count}\n' for stack, count in result['samples'].most_common())
+
+    def pstats(self):
+        """ Return the merged cProfile results as a pstats file """
+        result = self._result
+        if not result or result['mode'] != 'cprofile' or not result['stats']:
+            return None
+        stats = result['stats']
+        fd, path = tempfile.mkstemp(suffix='.pstats')
+        os.close(fd)
+        try:
+            stats.dump_stats(path)
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[';'.join(reversed(stack))] += 1
+
+    def _wrap_handlers(self, handlers):
+        for mount in CONTROL_MOUNTS:
+            app = cherrypy.tree.apps.get(mount)
+            if app is None:
+                continue
+            root = app.root
+            names = handlers or [name for name in dir(type(root))
+                                 if not name.startswith('_') and getattr(getattr(root, name), 'exposed', False)]
+            for name in names:
+                handler = getattr(root, name, None)
+                if handler is None or not getattr(handler, 'exposed', False):
+                    raise ValueError(f'Unknown handler: {name}')
+                setattr(root, name, self._profiled(handler))
+                self._wrapped.append((root, name))
+
+    def _unwrap_handlers(self):
+        for root, name in self._wrapped:
+            # Removing the instance attribute uncovers the original method
+            delattr(root, name)
+        self._wrapped = []
+
+    def _profiled(self, handler):
+        @functools.wraps(handler)
+        def profiled(*args, **kwargs):
+            with self._profile_lock:
+                profile = self._profile
+                if profile is None:
+                    # The capture stopped while this call waited
+                    return handler(*args, **kwargs)
+                self._calls += 1
+                return profile.runcall(handler, *args, **kwargs)
+        return profiled
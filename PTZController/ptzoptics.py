@@ -0,0 +1,174 @@
+"""
+Parsing of the PTZOptics HTTP-CGI commands, as sent by the PTZOptics OBS
+plugin and other third-party controllers:
+
+    /cgi-bin/ptzctrl.cgi?ptzcmd&leftup&12&10
+    /cgi-bin/ptzctrl.cgi?ptzcmd&right&12&10&zoomin&5
+    /cgi-bin/ptzctrl.cgi?ptzcmd&abs&24&20&0100&FF00
+    /cgi-bin/param.cgi?post_image_value&flip&1
+
+A query can hold several commands. They are parsed into one PtzCommand,
+so all the axis commands of a query become a single camera move.
+"""
+
+# Direction of each pan/tilt command. Positive pan is right and positive
+# tilt is up, as in ONVIF and the controls of index.html.
+DIRECTIONS = {
+    'up': (0, 1),
+    'down': (0, -1),
+    'left': (-1, 0),
+    'right': (1, 0),
+    'leftup': (-1, 1),
+    'rightup': (1, 1),
+    'leftdown': (-1, -1),
+    'rightdown': (1, -1),
+}
+
+# Command name: (kind, value, number of arguments)
+COMMANDS = dict({name: ('pantilt', direction, 2) for name, direction in DIRECTIONS.items()}, **{
+    'zoomin': ('zoom', 1, 1),
+    'zoomout': ('zoom', -1, 1),
+    'ptzstop': ('stop', 'pantilt', 0),
+    'zoomstop': ('stop', 'zoom', 0),
+    'focusin': ('focus', 1, 1),
+    'focusout': ('focus', -1, 1),
+    'focusstop': ('focusstop', None, 0),
+    'home': ('home', None, 0),
+    'poscall': ('preset', 'call', 1),
+    'posset': ('preset', 'set', 1),
+    'posclear': ('preset', 'clear', 1),
+    'abs': ('position', 'absolute', 4),
+    'rel': ('position', 'relative', 4),
+    'zoomto': ('zoomto', None, 2),
+})
+
+PAN_SPEED_MAX = 24
+TILT_SPEED_MAX = 20
+ZOOM_SPEED_MAX = 7
+FOCUS_SPEED_MAX = 7
+DEFAULT_SPEEDS = (12, 10, 4)
+
+# Scale of the VISCA positions used by abs, rel and zoomto
+PAN_POSITION_MAX = 0x0990
+TILT_POSITION_MAX = 0x0510
+ZOOM_POSITION_MAX = 0x4000
+
+IMAGE_PARAMS = ('flip', 'mirror')
+
+
+class PtzCommand(object):
+    """ The camera actions of one ptzctrl.cgi query """
+
+    def __init__(self):
+        self.pantilt = None
+        self.zoom = None
+        self.stop_pantilt = False
+        self.stop_zoom = False
+        self.focus = None
+        self.focus_stop = False
+        self.home = False
+        self.presets = []
+        self.position = None
+        self.unknown = []
+
+    @property
+    def velocity(self):
+        """
+        The (pan, tilt, zoom) velocity of a single continuous move, with None
+        for the axes the query leaves alone. None if the query has no motion.
+        """
+        if self.pantilt is None and self.zoom is None:
+            return None
+        pan, tilt = self.pantilt if self.pantilt is not None else ((0, 0) if self.stop_pantilt else (None, None))
+        zoom = self.zoom if self.zoom is not None else (0 if self.stop_zoom else None)
+        return (pan, tilt, zoom)
+
+
+def _number(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _position(value, scale):
+    """ Convert a 4 digit signed hex VISCA position to [-1, 1] """
+    try:
+        position = int(value, 16)
+    except (TypeError, ValueError):
+        return None
+    if position >= 0x8000:
+        position -= 0x10000
+    return max(-1.0, min(1.0, position / scale))
+
+
+def _speed(value, maximum, default):
+    return max(1, min(maximum, _number(value, default))) / maximum
+
+
+def parse_ptzcmd(args):
+    """ Parse the arguments of a ptzctrl.cgi query, which start with 'ptzcmd' """
+    command = PtzCommand()
+    i = 1
+    while i < len(args):
+        name = args[i].lower()
+        i += 1
+        if name not in COMMANDS:
+            if name:
+                command.unknown.append(name)
+            continue
+        kind, value, count = COMMANDS[name]
+        params = []
+        while len(params) < count and i < len(args) and args[i].lower() not in COMMANDS:
+            params.append(args[i])
+            i += 1
+        params += [None] * (count - len(params))
+
+        if kind == 'pantilt':
+            pan_speed = _speed(params[0], PAN_SPEED_MAX, DEFAULT_SPEEDS[0])
+            tilt_speed = _speed(params[1], TILT_SPEED_MAX, DEFAULT_SPEEDS[1])
+            command.pantilt = (value[0] * pan_speed, value[1] * tilt_speed)
+        elif kind == 'zoom':
+            command.zoom = value * _speed(params[0], ZOOM_SPEED_MAX, DEFAULT_SPEEDS[2])
+        elif kind == 'stop':
+            if value == 'pantilt':
+                command.stop_pantilt = True
+            else:
+                command.stop_zoom = True
+        elif kind == 'focus':
+            command.focus = value * _speed(params[0], FOCUS_SPEED_MAX, DEFAULT_SPEEDS[2])
+        elif kind == 'focusstop':
+            command.focus_stop = True
+        elif kind == 'home':
+            command.home = True
+        elif kind == 'preset':
+            # Clients number the presets from 1, one higher than the camera's preset tokens.
+            # A missing or lower number is invalid and skipped.
+            number = _number(params[0])
+            if number >= 1:
+                command.presets.append((value, str(number - 1)))
+        elif kind == 'position':
+            speed = (_speed(params[0], PAN_SPEED_MAX, PAN_SPEED_MAX), _speed(params[1], TILT_SPEED_MAX, TILT_SPEED_MAX))
+            pan, tilt = _position(params[2], PAN_POSITION_MAX), _position(params[3], TILT_POSITION_MAX)
+            if pan is not None and tilt is not None:
+                command.position = (value, (pan, tilt, None), (speed[0], speed[1], 1.0))
+        elif kind == 'zoomto':
+            zoom = _position(params[1], ZOOM_POSITION_MAX)
+            if zoom is not None:
+                speed = _speed(params[0], ZOOM_SPEED_MAX, ZOOM_SPEED_MAX)
+                command.position = ('absolute', (None, None, max(0.0, zoom)), (1.0, 1.0, speed))
+    return command
+
+
+def parse_param(args):
+    """
+    Parse the arguments of a param.cgi query such as post_image_value&flip&1.
+    Returns a list of (param, value) for the supported image params.
+    """
+    params = []
+    if not args or args[0] != 'post_image_value':
+        return params
+    for i in range(1, len(args) - 1, 2):
+        if args[i] in IMAGE_PARAMS:
+            params.append((args[i], args[i + 1] == '1'))
+    return params
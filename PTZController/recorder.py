@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import cherrypy
+
+from . import logger
+
+
+class Recorder(object):
+    """
+    Records the commands received on the /control and /cgi-bin mounts.
+
+    Each command is one line of seconds since the start of the recording, the
+    request path and the query string, separated by tabs:
+
+        12.3456\t/control/move\tpan=0.25&tilt=0&camera=1
+
+    Recordings are replayed with python -m PTZController.replay.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._start = None
+        self._count = 0
+
+    @property
+    def recording(self):
+        return self._file is not None
+
+    def start(self, path):
+        with self._lock:
+            if self._file is not None:
+                raise ValueError(f'Already recording to {self._path}')
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8')
+            self._file.write(f'# PTZController recording started {datetime.now().isoformat()}\n')
+            self._path = path
+            self._start = time.monotonic()
+            self._count = 0
+        logger.info(f'Recording control commands to {path}')
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logger.info(f'Recorded {self._count} control commands to {self._path}')
+        return self.status()
+
+    def status(self):
+        return {'recording': self.recording, 'file': self._path, 'commands': self._count}
+
+    def record(self):
+        """ CherryPy hook, run when a request arrives """
+        if self._file is None:
+            return
+        request = cherrypy.request
+        line = f'{time.monotonic() - self._start:.4f}\t{request.script_name}{request.path_info}\t{request.query_string}\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._count += 1
@@ -0,0 +1,152 @@
+import argparse
+import http.client
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qsl
+
+
+def load(path):
+    """ Read a recording made by the Recorder. Returns a list of (seconds, path, query) """
+    commands = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            commands.append((float(parts[0]), parts[1], parts[2] if len(parts) > 2 else ''))
+    return commands
+
+
+def retarget(query, camera):
+    """ Return the query string with its camera parameter replaced """
+    # ptzctrl.cgi queries such as ptzcmd&left&10&10 are positional, so the order is kept
+    parts = [part for part in query.split('&') if part and not part.startswith('camera=')]
+    parts.append(f'camera={camera}')
+    return '&'.join(parts)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class Replay(object):
+    """
+    Re-issues a recording against a running PTZController.
+
+    Commands are grouped by target camera. Each group is sent in order on its
+    own keep-alive connection, at the recorded time divided by speed. For
+    every command the latency (send to response) and staleness (scheduled
+    time to response, which includes any queueing behind earlier commands
+    of the same camera) are measured.
+    """
+
+    def __init__(self, commands, url, speed=1.0, cameras=None, timeout=10):
+        self.commands = commands
+        self.url = urlparse(url)
+        self.speed = speed
+        self.cameras = cameras
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+
+    def _groups(self):
+        groups = defaultdict(list)
+        for seconds, path, query in self.commands:
+            if self.cameras:
+                for camera in self.cameras:
+                    groups[camera].append((seconds, path, retarget(query, camera)))
+            else:
+                camera = dict(parse_qsl(query)).get('camera', '1')
+                groups[camera].append((seconds, path, query))
+        return groups
+
+    def run(self):
+        threads = []
+        start = time.monotonic() + 0.5
+        for camera, commands in self._groups().items():
+            th = threading.Thread(target=self._send, args=(start, commands), name=f'Replay-{camera}', daemon=True)
+            threads.append(th)
+            th.start()
+        for th in threads:
+            th.join()
+        return time.monotonic() - start
+
+    def _connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.hostname, self.url.port or 443, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def _send(self, start, commands):
+        conn = self._connect()
+        base = self.url.path.rstrip('/')
+        for seconds, path, query in commands:
+            due = start + seconds / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.monotonic()
+            try:
+                conn.request('GET', f'{base}{path}?{query}' if query else f'{base}{path}')
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = self._connect()
+                status = None
+            done = time.monotonic()
+            with self._lock:
+                self.results.append((path, status, done - sent, done - due))
+        conn.close()
+
+    def report(self, elapsed):
+        lines = []
+        latency = [result[2] for result in self.results]
+        staleness = [result[3] for result in self.results]
+        errors = sum(1 for result in self.results if result[1] is None or result[1] >= 400)
+        lines.append(f'Commands: {len(self.results)}  Errors: {errors}  Elapsed: {elapsed:.2f}s  '
+                     f'Rate: {len(self.results) / elapsed if elapsed > 0 else 0:.1f}/s')
+        lines.append(f'{"":24}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+        lines.append(self._row('latency', latency))
+        lines.append(self._row('staleness', staleness))
+        by_path = defaultdict(list)
+        for path, status, lat, stale in self.results:
+            by_path[path].append(lat)
+        for path in sorted(by_path):
+            lines.append(self._row(f'  {path}', by_path[path]))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _row(name, values):
+        return f'{name[:24]:24}' + ''.join(f'{percentile(values, pct) * 1000:10.1f}' for pct in (50, 95, 99, 100))
+
+
+def positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive number')
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recording of PTZController control commands.')
+    parser.add_argument('recording', help='Recording file made with /admin/record_start')
+    parser.add_argument('--url', default='http://localhost:8080', help='PTZController to replay against')
+    parser.add_argument('--speed', type=positive_float, default=1.0, help='Speed multiplier, 2 replays twice as fast')
+    parser.add_argument('--cameras', help='Comma separated camera IDs. Every command is sent to each of them')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for each response')
+    args = parser.parse_args()
+
+    cameras = [camera.strip() for camera in args.cameras.split(',')] if args.cameras else None
+    replay = Replay(load(args.recording), args.url, speed=args.speed, cameras=cameras, timeout=args.timeout)
+    elapsed = replay.run()
+    print(replay.report(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+from lxml import etree
+from onvif import ONVIFCamera
+
+from . import logger
+
+
+FILENAME = 'sessions.json'
+
+
+def _json_default(value):
+    # Vendor extensions of the capabilities are XML elements
+    if isinstance(value, etree._Element):
+        return etree.tostring(value, encoding='unicode')
+    return str(value)
+
+
+def normalize(state):
+    """ The session state as it is read back from the cache, for comparing states """
+    return json.loads(json.dumps(state, default=_json_default))
+
+
+class CachedONVIFCamera(ONVIFCamera):
+    """
+    An ONVIFCamera that takes its service addresses from a session cache,
+    rather than asking the camera for them with GetCapabilities. Without
+    cached addresses it is a plain ONVIFCamera.
+    """
+
+    def __init__(self, host, port, user, passwd, xaddrs=None, **kwargs):
+        self.cached_xaddrs = xaddrs
+        super().__init__(host, port, user, passwd, **kwargs)
+
+    def update_xaddrs(self):
+        if not self.cached_xaddrs:
+            return super().update_xaddrs()
+        self.dt_diff = None
+        self.xaddrs = dict(self.cached_xaddrs)
+
+
+class SessionCache(object):
+    """
+    On-disk cache of what a camera's ONVIF initialization resolves: its
+    service addresses, the tokens of its profile, PTZ configuration, PTZ node
+    and video source, its PTZ capabilities and its firmware version.
+
+    Entries are looked up by host and port. The firmware version is part of
+    the key: an entry is only valid for the firmware it was resolved with,
+    which the camera revalidates in the background after starting from it.
+
+    The file is re-read before each write, so the worker processes and the
+    main process can share it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    @staticmethod
+    def key(host, port):
+        return f'{host}:{port}'
+
+    def get(self, host, port):
+        with self._lock:
+            return self._entries.get(self.key(host, port))
+
+    def put(self, host, port, state):
+        with self._lock:
+            self._entries = self._load()
+            self._entries[self.key(host, port)] = state
+            self._save()
+
+    def remove(self, host, port):
+        with self._lock:
+            self._entries = self._load()
+            if self._entries.pop(self.key(host, port), None) is not None:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring the camera session cache {self.path}: {e}')
+            return {}
+
+    def _save(self):
+        try:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            temp = f'{self.path}.{os.getpid()}.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=2, default=_json_default)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.error(f'Unable to write the camera session cache {self.path}: {e}')
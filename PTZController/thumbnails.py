@@ -0,0 +1,153 @@
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+    no_pil = False
+except ImportError:
+    no_pil = True
+
+from . import logger
+
+
+class ThumbnailCache(object):
+    """
+    On-disk cache of preset thumbnails with size-bounded LRU eviction.
+
+    Each thumbnail is a JPEG file named after its camera and preset. The
+    recency order is kept in memory and seeded from the file modification
+    times at startup. When Pillow is installed the snapshots are downscaled
+    to the configured width, otherwise they are stored as received.
+    """
+
+    def __init__(self, directory, max_bytes, width=320, delay=3.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        self._timers = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.jpg'):
+                continue
+            st = os.stat(os.path.join(self.directory, filename))
+            files.append((st.st_mtime, filename[:-4], st.st_size))
+        for mtime, key, size in sorted(files):
+            self._entries[key] = (size, int(mtime))
+            self._total += size
+        self._evict()
+        if no_pil:
+            logger.info('Pillow is not installed. Preset thumbnails are stored at full size.')
+
+    @staticmethod
+    def key(camera, preset):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', f'{camera.host}_{camera.port}_{preset}')
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.jpg')
+
+    def get(self, camera, preset):
+        """ Return (path, version) of the thumbnail, or None if there is none """
+        key = self.key(camera, preset)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return self.path(key), entry[1]
+
+    def version(self, camera, preset):
+        with self._lock:
+            entry = self._entries.get(self.key(camera, preset))
+        return entry[1] if entry else None
+
+    def put(self, camera, preset, data):
+        data = self._downscale(data)
+        key = self.key(camera, preset)
+        path = self.path(key)
+        # A temp file of its own, as captures of the same preset may overlap
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        version = int(os.path.getmtime(path))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._total -= old[0]
+                # Keep the version moving so cached copies are not reused
+                version = max(version, old[1] + 1)
+            self._entries[key] = (len(data), version)
+            self._total += len(data)
+            self._evict()
+
+    def capture(self, camera, preset, delay=None):
+        """
+        Snapshot the camera in the background after delay seconds, giving a
+        recalled preset time to arrive. A newer capture of the same preset
+        replaces a pending one. The thumbnails of remote cameras are taken
+        by the node they belong to.
+        """
+        if getattr(camera, 'remote', False):
+            return
+        delay = self.delay if delay is None else delay
+        key = self.key(camera, preset)
+        timer = threading.Timer(delay, self._capture, args=(camera, preset, key))
+        timer.name = f'Thumbnail-{camera.name}'
+        timer.daemon = True
+        with self._lock:
+            pending = self._timers.pop(key, None)
+            if pending:
+                pending.cancel()
+            self._timers[key] = timer
+        timer.start()
+
+    def _capture(self, camera, preset, key):
+        with self._lock:
+            self._timers.pop(key, None)
+        if not camera.isconnected:
+            return
+        try:
+            data = camera.get_snapshot()
+        except Exception as e:
+            logger.debug(f'Camera {camera.name}: Unable to capture thumbnail for preset {preset}: {e}')
+            return
+        if data:
+            self.put(camera, preset, data)
+            logger.debug(f'Camera {camera.name}: Captured thumbnail for preset {preset}')
+
+    def _downscale(self, data):
+        if no_pil:
+            return data
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.width > self.width:
+                image = image.resize((self.width, int(image.height * self.width / image.width)))
+            out = io.BytesIO()
+            image.convert('RGB').save(out, 'JPEG', quality=80)
+            return out.getvalue()
+        except Exception as e:
+            logger.debug(f'Unable to downscale thumbnail: {e}')
+            return data
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            key, (size, version) = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
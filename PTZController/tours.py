@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from . import logger
+
+
+FILENAME = "tours.json"
+
+
+class TourError(Exception):
+    pass
+
+
+class TourRun(object):
+    """
+    A running instance of a tour.
+
+    Step deadlines are computed from the start time plus the cumulative offset
+    of the steps before it, so a late step never delays the steps after it.
+    """
+
+    def __init__(self, name, tour):
+        self.name = name
+        self.steps = tour['steps']
+        self.loop = bool(tour.get('loop', False))
+        self.state = 'running'
+        self.index = 0
+        self.loops = 0
+        self.base = time.monotonic()
+        self.offset = 0.0
+        self.deadline = self.base
+        self.paused_at = None
+        self.generation = 0
+        self.fired = 0
+        self.errors = 0
+        self.drift_total = 0.0
+        self.drift_max = 0.0
+        self.drift_last = 0.0
+
+    def record_drift(self, drift):
+        self.fired += 1
+        self.drift_last = drift
+        self.drift_total += drift
+        self.drift_max = max(self.drift_max, drift)
+
+    def status(self):
+        return {
+            'tour': self.name,
+            'state': self.state,
+            'step': self.index,
+            'steps': len(self.steps),
+            'loop': self.loop,
+            'loops': self.loops,
+            'fired': self.fired,
+            'errors': self.errors,
+            'drift_last_ms': round(self.drift_last * 1000, 3),
+            'drift_mean_ms': round(self.drift_total / self.fired * 1000, 3) if self.fired else 0.0,
+            'drift_max_ms': round(self.drift_max * 1000, 3),
+        }
+
+
+class TourScheduler(object):
+    """
+    Runs named tours of preset recalls, timed continuous moves and dwells.
+
+    A single scheduler thread keeps a heap of step deadlines on the monotonic
+    clock and sleeps until the next one is due. Camera commands are handed to
+    a small thread pool so a slow camera cannot delay the timing of other
+    steps or other tours.
+    """
+
+    def __init__(self, ptzcontroller, tours_file):
+        self.ptzcontroller = ptzcontroller
+        self.tours_file = tours_file
+        self.tours = {}
+        self._runs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='TourStep')
+        self.load()
+        th = threading.Thread(target=self._run, name="TourScheduler", daemon=True)
+        th.start()
+
+    def load(self):
+        """
+        Load the tour definitions. The file is a JSON object of tour names, each with
+        a list of steps and an optional loop flag, for example:
+
+            {"Opening": {"loop": false, "steps": [
+                {"camera": 1, "preset": "2", "dwell": 5},
+                {"camera": [1, 2], "move": [0.2, 0, 0], "duration": 2.5},
+                {"dwell": 3},
+                {"camera": 2, "home": true}
+            ]}}
+        """
+        try:
+            with open(self.tours_file, encoding='utf-8') as f:
+                tours = json.load(f)
+        except FileNotFoundError:
+            tours = {}
+        except (OSError, ValueError) as e:
+            logger.error(f'Unable to load tours from {self.tours_file}: {e}')
+            return False
+        if not isinstance(tours, dict):
+            logger.error(f'Unable to load tours from {self.tours_file}: not a JSON object of tours')
+            return False
+        loaded = {}
+        for name, tour in tours.items():
+            error = self._validate(tour)
+            if error:
+                logger.error(f'Tour {name} {error}. Ignored.')
+                continue
+            loaded[name] = tour
+        # Tours removed from the file are gone after a reload
+        self.tours = loaded
+        logger.info(f'Loaded {len(self.tours)} tours from {self.tours_file}')
+        return True
+
+    @staticmethod
+    def _validate(tour):
+        """ Returns what is wrong with a tour definition, or None """
+        if not isinstance(tour, dict) or not isinstance(tour.get('steps'), list) or not tour['steps']:
+            return 'has no list of steps'
+        for number, step in enumerate(tour['steps'], 1):
+            if not isinstance(step, dict):
+                return f'step {number} is not an object'
+            for key in ('dwell', 'duration'):
+                value = step.get(key, 0)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    return f'step {number} has a {key} that is not a number of seconds'
+            if 'move' in step and (not isinstance(step['move'], list) or len(step['move']) != 3):
+                return f'step {number} has a move that is not a list of pan, tilt and zoom'
+        # A loop of steps that all take no time would never let the scheduler sleep
+        if tour.get('loop') and not any(step.get('dwell', step.get('duration', 0)) > 0 for step in tour['steps']):
+            return 'loops but none of its steps has a dwell or duration'
+        return None
+
+    def start(self, name):
+        if name not in self.tours:
+            raise TourError(f'Unknown tour: {name}')
+        with self._cond:
+            run = self._runs.get(name)
+            if run is not None and run.state in ('running', 'paused'):
+                raise TourError(f'Tour {name} is already {run.state}')
+            run = TourRun(name, self.tours[name])
+            self._runs[name] = run
+            logger.info(f'Tour {name}: Starting')
+            self._schedule(run)
+        return run.status()
+
+    def stop(self, name):
+        with self._cond:
+            run = self._get_run(name)
+            run.state = 'stopped'
+            run.generation += 1
+            logger.info(f'Tour {name}: Stopped')
+        return run.status()
+
+    def pause(self, name):
+        with self._cond:
+            run = self._get_run(name)
+            if run.state != 'running':
+                raise TourError(f'Tour {name} is not running')
+            run.state = 'paused'
+            run.paused_at = time.monotonic()
+            run.generation += 1
+            logger.info(f'Tour {name}: Paused')
+        return run.status()
+
+    def resume(self, name):
+        with self._cond:
+            run = self._get_run(name)
+            if run.state != 'paused':
+                raise TourError(f'Tour {name} is not paused')
+            # Shift the whole timeline by the time spent paused
+            run.base += time.monotonic() - run.paused_at
+            run.paused_at = None
+            run.state = 'running'
+            logger.info(f'Tour {name}: Resumed')
+            self._schedule(run)
+        return run.status()
+
+    def status(self):
+        with self._cond:
+            return [run.status() for run in self._runs.values()]
+
+    def _get_run(self, name):
+        run = self._runs.get(name)
+        if run is None:
+            raise TourError(f'Tour {name} has not been started')
+        return run
+
+    def _schedule(self, run):
+        run.deadline = run.base + run.offset
+        heapq.heappush(self._heap, (run.deadline, next(self._counter), run.generation, run))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        deadline, _, generation, run = heapq.heappop(self._heap)
+                        if generation != run.generation or run.state != 'running':
+                            continue
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+                # One failing tour must not stop the scheduler, and with it all other tours
+                try:
+                    run.record_drift(now - deadline)
+                    step = run.steps[run.index]
+                    self._executor.submit(self._run_step, run, step)
+                    self._advance(run, step)
+                except Exception as e:
+                    run.errors += 1
+                    run.state = 'failed'
+                    logger.error(f'Tour {run.name}: Failed at step {run.index + 1}: {e}')
+
+    def _advance(self, run, step):
+        run.offset += float(step.get('dwell', step.get('duration', 0)))
+        run.index += 1
+        if run.index >= len(run.steps):
+            if not run.loop:
+                run.state = 'finished'
+                logger.info(f'Tour {run.name}: Finished')
+                return
+            run.index = 0
+            run.loops += 1
+        self._schedule(run)
+
+    def _run_step(self, run, step):
+        camera_ids = step.get('camera')
+        if camera_ids is None:
+            return
+        if not isinstance(camera_ids, list):
+            camera_ids = [camera_ids]
+        for camera_id in camera_ids:
+            camera = self.ptzcontroller.get_camera(camera_id)
+            if not camera or not camera.isconnected:
+                logger.debug(f'Tour {run.name}: Camera {camera_id} is not available')
+                run.errors += 1
+                continue
+            try:
+                if 'preset' in step:
+                    camera.goto_preset(step['preset'])
+                elif 'move' in step:
+                    timeout = timedelta(seconds=float(step['duration'])) if 'duration' in step else None
+                    camera.move_continuous(step['move'], timeout=timeout)
+                elif step.get('home'):
+                    camera.go_home()
+                elif step.get('stop'):
+                    camera.stop()
+            except Exception as e:
+                run.errors += 1
+                logger.error(f'Tour {run.name}: Step {step} failed on Camera {camera.name}: {e}')
@@ -0,0 +1,320 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import cherrypy
+
+from . import logger
+from .replay import percentile
+
+
+SPANS = ('client', 'queue', 'receive', 'dispatch', 'method', 'soap_send', 'camera_response', 'response', 'total')
+SUMMARY_SIZE = 1000
+QUEUE_SIZE = 10000
+# Client timestamps further off than this are from replays or clocks that are not in sync
+MAX_CLIENT_SKEW = 60
+
+_current = threading.local()
+
+
+def current():
+    """ The trace of the command running on this thread, or None when it is not sampled """
+    return getattr(_current, 'trace', None)
+
+
+def camera_resolved(camera):
+    """ Called by the handlers once they have looked up the camera, just before calling its method """
+    trace = getattr(_current, 'trace', None)
+    if trace is not None:
+        trace.camera = camera
+        trace.resolved = time.time()
+
+
+class Trace(object):
+    """ The timestamps of one sampled command. All times are seconds since the epoch. """
+
+    def __init__(self, path, received, queued=None):
+        self.path = path
+        self.queued = queued
+        self.received = received
+        self.client = None
+        self.started = time.time()
+        self.dispatched = None
+        self.resolved = None
+        self.handled = None
+        self.camera = None
+        self.status = None
+        self.soap = []
+
+    def spans(self, ended):
+        """ Returns the spans in milliseconds and the SOAP calls """
+        ms = lambda start, end: round((end - start) * 1000, 3)
+        handled = self.handled or ended
+        spans = {'receive': ms(self.received, self.started)}
+        arrived = self.received
+        if self.queued is not None:
+            spans['queue'] = ms(self.queued, self.received)
+            arrived = self.queued
+        if self.client is not None:
+            spans['client'] = ms(self.client, arrived)
+        method_start = self.resolved or self.dispatched
+        if method_start is not None:
+            spans['dispatch'] = ms(self.started, method_start)
+            spans['method'] = ms(method_start, handled)
+        calls = []
+        if self.soap:
+            previous = method_start or self.started
+            for call in self.soap:
+                # A call that timed out or failed has no response
+                response = call['response'] or handled
+                calls.append({'operation': call['operation'], 'send': ms(previous, call['send']),
+                              'response': ms(call['send'], response)})
+                previous = response
+            spans['soap_send'] = round(sum(call['send'] for call in calls), 3)
+            spans['camera_response'] = round(sum(call['response'] for call in calls), 3)
+        spans['response'] = ms(handled, ended)
+        spans['total'] = ms(self.client if self.client is not None else arrived, ended)
+        return {span: spans[span] for span in SPANS if span in spans}, calls
+
+
+class TracePlugin(object):
+    """
+    zeep plugin that timestamps the SOAP requests of the traced command. The
+    egress hook runs once the request is serialized and the ingress hook once
+    the camera's response is parsed, on the thread of the command.
+    """
+
+    def egress(self, envelope, http_headers, operation, binding_options):
+        trace = getattr(_current, 'trace', None)
+        if trace is not None:
+            trace.soap.append({'operation': operation.name, 'send': time.time(), 'response': None})
+        return envelope, http_headers
+
+    def ingress(self, envelope, http_headers, operation):
+        trace = getattr(_current, 'trace', None)
+        if trace is not None and trace.soap and trace.soap[-1]['response'] is None:
+            trace.soap[-1]['response'] = time.time()
+        return envelope, http_headers
+
+
+def instrument(*services):
+    """ Add the trace plugin to ONVIF services """
+    for service in services:
+        plugins = service.zeep_client.plugins
+        if not any(isinstance(plugin, TracePlugin) for plugin in plugins):
+            plugins.append(TracePlugin())
+
+
+def watch_queue(httpserver):
+    """
+    Timestamp the connections of a cheroot server as they are queued for a
+    server thread. The server queues a connection once a request arrives on
+    it, and each of its worker threads has the connection it handles as conn.
+    """
+    process_conn = httpserver.process_conn
+
+    def queued(conn):
+        conn.queued = time.time()
+        process_conn(conn)
+    httpserver.process_conn = queued
+
+
+class Tracer(object):
+    """
+    Traces a sample of the camera commands from the client to the camera.
+
+    Each sampled command is written as one JSON line to the trace file, with
+    its spans in milliseconds:
+
+        client           the client's timestamp t to the request arriving at the server
+        queue            the request waiting for a free server thread
+        receive          reading the request, to the start of the CherryPy pipeline
+        dispatch         the CherryPy tools and the handler, up to the camera method
+        method           the camera method, including its SOAP calls
+        soap_send        building and serializing the SOAP requests
+        camera_response  the SOAP requests on the wire and in the camera
+        response         encoding and sending the response
+        total            client, or queue when the client sent no t, to the end
+
+    Commands that are not sampled cost one random number. The recent spans of
+    every camera are kept in memory for summary().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._path = None
+        self.sample = 0.0
+        self._count = 0
+        self._dropped = 0
+        self._recent = {}
+
+    @property
+    def tracing(self):
+        return self._queue is not None
+
+    def start(self, path, sample=0.1):
+        sample = float(sample)
+        if not 0 < sample <= 1:
+            raise ValueError('sample must be a fraction between 0 and 1')
+        with self._lock:
+            if self._queue is not None:
+                raise ValueError(f'Already tracing to {self._path}')
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            file = open(path, 'a', encoding='utf-8')
+            self._queue = queue.Queue(QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._write, args=(file, self._queue), name='TraceWriter', daemon=True)
+            self._thread.start()
+            self._path = path
+            self.sample = sample
+            self._count = 0
+            self._dropped = 0
+        logger.info(f'Tracing {sample:.0%} of the control commands to {path}')
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            q, self._queue = self._queue, None
+            thread, self._thread = self._thread, None
+            self.sample = 0.0
+        if q is not None:
+            q.put(None)
+            thread.join(5)
+            logger.info(f'Traced {self._count} control commands to {self._path}')
+        return self.status()
+
+    def status(self):
+        return {'tracing': self.tracing, 'file': self._path, 'sample': self.sample,
+                'traces': self._count, 'dropped': self._dropped}
+
+    def summary(self):
+        """ The latency percentiles of each span of the recent traces, per camera """
+        with self._lock:
+            recent = {key: {span: list(values) for span, values in spans.items()} for key, spans in self._recent.items()}
+        result = []
+        for (camera_id, name), spans in sorted(recent.items(), key=lambda item: (item[0][0] is None, item[0][0] or 0)):
+            result.append({'camera': camera_id, 'name': name, 'traces': len(spans.get('total', [])),
+                           'spans': {span: {'p50': percentile(values, 50), 'p95': percentile(values, 95),
+                                            'p99': percentile(values, 99), 'max': max(values)}
+                                     for span, values in sorted(spans.items(), key=lambda item: SPANS.index(item[0]))}})
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._recent = {}
+
+    def begin(self, path, received, queued=None):
+        """
+        Start tracing a command on this thread if it is sampled. received is when
+        a server thread took the request, queued when it arrived and waited for
+        one. Returns the trace or None.
+        """
+        if self._queue is None or random.random() >= self.sample:
+            _current.trace = None
+            return None
+        trace = _current.trace = Trace(path, received, queued)
+        return trace
+
+    def client_time(self, value):
+        """ Set the client's timestamp, in milliseconds since the epoch, of the traced command """
+        trace = getattr(_current, 'trace', None)
+        if trace is None or value is None:
+            return
+        try:
+            client = float(value) / 1000
+        except (TypeError, ValueError):
+            return
+        if abs(trace.received - client) <= MAX_CLIENT_SKEW:
+            trace.client = client
+
+    def end(self, status=None):
+        trace = getattr(_current, 'trace', None)
+        if trace is None:
+            return
+        _current.trace = None
+        ended = time.time()
+        trace.status = status
+        spans, calls = trace.spans(ended)
+        camera = trace.camera
+        entry = {'time': round(trace.received, 6), 'path': trace.path, 'status': status,
+                 'camera': camera.id if camera else None, 'name': camera.name if camera else None,
+                 'spans': spans}
+        if calls:
+            entry['soap'] = calls
+        with self._lock:
+            q = self._queue
+            recent = self._recent.setdefault((entry['camera'], entry['name']), {})
+            for span, value in spans.items():
+                recent.setdefault(span, deque(maxlen=SUMMARY_SIZE)).append(value)
+        if q is None:
+            return
+        try:
+            q.put_nowait(entry)
+            self._count += 1
+        except queue.Full:
+            self._dropped += 1
+
+    def _write(self, file, q):
+        with file:
+            while True:
+                entry = q.get()
+                if entry is None:
+                    return
+                try:
+                    file.write(json.dumps(entry) + '\n')
+                    if q.empty():
+                        file.flush()
+                except (OSError, ValueError) as e:
+                    logger.error(f'Unable to write to trace file {self._path}: {e}')
+
+    # CherryPy hooks
+
+    def on_start_resource(self):
+        request = cherrypy.serving.request
+        # CherryPy timestamps the response once the request is read, and
+        # watch_queue() the connection when it is queued for a server thread
+        conn = getattr(threading.current_thread(), 'conn', None)
+        self.begin(request.script_name + request.path_info, getattr(cherrypy.serving.response, 'time', None) or time.time(),
+                   getattr(conn, 'queued', None))
+
+    def before_handler(self):
+        request = cherrypy.serving.request
+        # The client's timestamp is not an argument of the handlers
+        client = request.params.pop('t', None)
+        trace = getattr(_current, 'trace', None)
+        if trace is not None:
+            trace.dispatched = time.time()
+            self.client_time(client)
+
+    def before_finalize(self):
+        trace = getattr(_current, 'trace', None)
+        if trace is not None:
+            trace.handled = time.time()
+
+    def on_end_request(self):
+        if getattr(_current, 'trace', None) is not None:
+            status = str(cherrypy.serving.response.status or '200').split(' ')[0]
+            self.end(int(status) if status.isdigit() else None)
+
+
+class TraceTool(cherrypy.Tool):
+    """ Attaches the hooks of a Tracer to the requests of the /control and /cgi-bin mounts """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        super().__init__('on_start_resource', tracer.on_start_resource)
+
+    def _setup(self):
+        super()._setup()
+        hooks = cherrypy.serving.request.hooks
+        # Run after the other before_handler tools and first in before_finalize
+        hooks.attach('before_handler', self.tracer.before_handler, priority=90)
+        hooks.attach('before_finalize', self.tracer.before_finalize, priority=10)
+        hooks.attach('on_end_request', self.tracer.on_end_request)
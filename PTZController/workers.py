@@ -0,0 +1,273 @@
+import itertools
+import multiprocessing
+import pickle
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from types import SimpleNamespace
+
+from zeep.xsd import CompoundValue
+
+from . import logger
+from .preview import open_stream
+
+
+CALL_TIMEOUT = 30
+
+
+class CameraWorkerError(Exception):
+    pass
+
+
+def _portable(value):
+    """
+    Convert a camera result into plain picklable values. zeep objects become
+    SimpleNamespace objects, so callers can keep using attribute access such
+    as preset.Name and preset.token.
+    """
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(_portable(item) for item in value)
+    if isinstance(value, CompoundValue):
+        return SimpleNamespace(**{key: _portable(value[key]) for key in value})
+    if isinstance(value, dict):
+        return {key: _portable(item) for key, item in value.items()}
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        return str(value)
+
+
+def _worker_main(conn, number, console, log_dir, verbose, power_options, session_cache=None):
+    """ Entry point of a camera worker process """
+    from .camera import Camera
+    from .power import PowerManager
+    from .sessions import SessionCache
+
+    logger.initLogger(console=console, log_dir=log_dir, verbose=verbose,
+                      filename=f'PTZController-worker{number}.log')
+    logger.info(f'Camera worker {number} started')
+
+    # Power commands are staggered among the cameras of this worker
+    power = PowerManager(*power_options)
+    sessions = SessionCache(session_cache) if session_cache else None
+    cameras = {}
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix=f'CameraWorker{number}')
+
+    def reply(request_id, ok, result):
+        with send_lock:
+            conn.send((request_id, ok, result))
+
+    def handle(request_id, op, camera_id, name, args, kwargs):
+        try:
+            if op == 'add':
+                cameras[camera_id] = Camera(args[0], power=power, sessions=sessions)
+                result = None
+            elif op == 'remove':
+                camera = cameras.pop(camera_id, None)
+                if camera is not None:
+                    camera.close()
+                result = None
+            elif op == 'get':
+                result = getattr(cameras[camera_id], name)
+            else:
+                result = getattr(cameras[camera_id], name)(*args, **kwargs)
+            reply(request_id, True, _portable(result))
+        except Exception as e:
+            logger.debug(f'Camera worker {number}: {op} {name} failed: {traceback.format_exc()}')
+            reply(request_id, False, f'{e.__class__.__name__}: {e}')
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        op = message[1]
+        if op in ('add', 'remove'):
+            # Keep camera bookkeeping in order with the calls that follow it
+            handle(*message)
+        else:
+            executor.submit(handle, *message)
+
+    for camera in cameras.values():
+        camera.close()
+    executor.shutdown(wait=False)
+
+
+class CameraWorker(object):
+    """
+    Front end side of one camera worker process.
+
+    Requests are pipelined over a multiprocessing Pipe: any number of threads
+    can have calls outstanding, and a reader thread matches each reply to its
+    request. If the process dies, its pending calls fail, the process is
+    restarted and its cameras are added again.
+    """
+
+    def __init__(self, number, worker_options):
+        self.number = number
+        self.worker_options = worker_options
+        self.cameras = {}
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stopping = False
+        self._start()
+
+    def _start(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, name=f'CameraWorker-{self.number}',
+                                   args=(child_conn, self.number) + self.worker_options, daemon=True)
+        self.process.start()
+        child_conn.close()
+        th = threading.Thread(target=self._read, args=(self._conn,), name=f'CameraWorkerReader-{self.number}', daemon=True)
+        th.start()
+        for camera_id, options in self.cameras.items():
+            self._send('add', camera_id, None, (options,), {})
+
+    def _read(self, conn):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(CameraWorkerError(result))
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(CameraWorkerError(f'Camera worker {self.number} exited'))
+        if not self._stopping:
+            self.process.join(1)
+            logger.error(f'Camera worker {self.number} exited with code {self.process.exitcode}. Restarting.')
+            self._start()
+
+    def _send(self, op, camera_id, name, args, kwargs):
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self._conn.send((request_id, op, camera_id, name, args, kwargs))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            future.set_exception(CameraWorkerError(f'Camera worker {self.number} unavailable: {e}'))
+        return future
+
+    def call(self, op, camera_id, name=None, args=(), kwargs=None, timeout=CALL_TIMEOUT):
+        future = self._send(op, camera_id, name, args, kwargs or {})
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            raise CameraWorkerError(f'Camera worker {self.number}: {name or op} timed out')
+
+    def add_camera(self, options):
+        self.cameras[options['id']] = options
+        self.call('add', options['id'], args=(options,))
+
+    def remove_camera(self, camera_id):
+        self.cameras.pop(camera_id, None)
+        self.call('remove', camera_id)
+
+    def stop(self):
+        self._stopping = True
+        try:
+            with self._send_lock:
+                self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class CameraProxy(object):
+    """
+    Stands in for a Camera that lives in a worker process. Attribute reads
+    and method calls are forwarded to the worker, so the web handlers use it
+    exactly like a local Camera.
+    """
+
+    def __init__(self, worker, options):
+        self._worker = worker
+        self.id = options['id']
+        self.name = options['name']
+        self.host = options.get('host')
+        self.port = int(options['port']) if 'port' in options else None
+        self.port_visca = int(options['port_visca']) if 'port_visca' in options else None
+        self.power_on = True if options.get('power_on') in ('yes', 'true', '0') else False
+        self.power_off = True if options.get('power_off') in ('yes', 'true', '0') else False
+        self.preview_uri = options.get('preview_uri')
+        self._options = options
+        self._worker.add_camera(options)
+
+    @property
+    def isconnected(self):
+        try:
+            return self._worker.call('get', self.id, 'isconnected', timeout=5)
+        except CameraWorkerError:
+            return False
+
+    @property
+    def capabilities(self):
+        return self._worker.call('get', self.id, 'capabilities')
+
+    @property
+    def configuration(self):
+        return self._worker.call('get', self.id, 'configuration')
+
+    @property
+    def configOptions(self):
+        return self._worker.call('get', self.id, 'configOptions')
+
+    def open_preview(self, timeout=5):
+        # A stream cannot cross the pipe, so it is opened by this process
+        return open_stream(self.preview_uri, self._options.get('userid'), self._options.get('password'), timeout=timeout)
+
+    def close(self):
+        try:
+            self._worker.remove_camera(self.id)
+        except CameraWorkerError as e:
+            logger.debug(f'Camera {self.name}: {e}')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._worker.call('call', self.id, name, args, kwargs)
+        call.__name__ = name
+        return call
+
+
+class CameraWorkerPool(object):
+    """ Spreads cameras across a fixed number of worker processes by camera ID """
+
+    def __init__(self, count, console=True, log_dir=None, verbose=False, power_options=(0, 60), session_cache=None):
+        logger.info(f'Starting {count} camera worker processes')
+        self.workers = [CameraWorker(number, (console, log_dir, verbose, power_options, session_cache))
+                        for number in range(1, count + 1)]
+
+    def create_camera(self, options):
+        worker = self.workers[(options['id'] - 1) % len(self.workers)]
+        return CameraProxy(worker, options)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
@@ -14,7 +14,6 @@ import pytz
 import datetime
 import argparse
 import signal
-import time
 
 # Ensure lib added to path, before any other imports
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
@@ -22,6 +21,9 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib
 import PTZController
 from PTZController import PTZController, logger
 
+# How often the main loop checks for signals from the operating system
+SIGNAL_POLL = 0.5
+
 
 def main():
     """
@@ -70,9 +72,9 @@ def main():
     parser.add_argument(
         '--nolaunch', action='store_true', help='Prevent browser from launching on startup')
     parser.add_argument(
-        '--pidfile', help='Create a pid file (only relevant when running as a daemon)')
+        '--pidfile', help='Create a pid file')
     parser.add_argument(
-        '--nofork', action='store_true', help='Start PTZController as a service, do not fork when restarting')
+        '--nofork', action='store_true', help='Do not fork with --daemon, for service managers such as systemd')
 
     args = parser.parse_args()
 
@@ -84,39 +86,116 @@ def main():
     # Do an intial setup of the logger.
     logger.initLogger(console=not args.quiet, log_dir=False, verbose=args.verbose)
 
+    if args.config:
+        args.config = os.path.abspath(args.config)
+
+    if args.daemon:
+        if sys.platform == 'win32':
+            print("Daemonizing is not supported on Windows. Use --nofork to run as a service.")
+        elif not args.nofork:
+            daemonize()
+        args.quiet = True
+        args.nolaunch = True
+
+    if args.pidfile:
+        write_pidfile(args.pidfile)
+
     ptzController = PTZController(args)
 
-    # Register signals, such as CTRL + C
+    # Register signals, such as CTRL + C. The handlers run on the main thread,
+    # possibly while it holds the lock of wakeup or of stdout, so they only
+    # queue the signal. The main loop picks it up within SIGNAL_POLL seconds.
     def sig_handler(signum=None, frame=None):
         if signum is not None:
-            print("Signal %i caught, saving and exiting..." % signum)
-            if ptzController:
-                ptzController.SIGNAL = 'shutdown'
+            ptzController.signals.append('shutdown')
+
+    # Reload the configuration on SIGHUP
+    def reload_handler(signum=None, frame=None):
+        ptzController.signals.append('reload')
+
+    # Restart the web server on SIGUSR1, keeping the cameras connected
+    def restart_handler(signum=None, frame=None):
+        ptzController.signals.append('restart')
 
     signal.signal(signal.SIGINT, sig_handler)
     signal.signal(signal.SIGTERM, sig_handler)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_handler)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, restart_handler)
 
-    # Wait endlessy for a signal to happen
+    # Wait for a signal to happen. Signals from the web server threads set
+    # wakeup, signals from the operating system are polled for.
     while True:
-        if not ptzController.SIGNAL:
-            try:
-                time.sleep(1)
-            except KeyboardInterrupt:
-                ptzController.SIGNAL = 'shutdown'
-        else:
-            print('Received signal: %s' % ptzController.SIGNAL)
-
-            if ptzController.SIGNAL == 'shutdown':
+        try:
+            ptzController.wakeup.wait(SIGNAL_POLL)
+        except KeyboardInterrupt:
+            ptzController.signals.append('shutdown')
+        ptzController.wakeup.clear()
+
+        # Act on every signal in the order they came. Signals that arrive while
+        # one is handled are queued behind it, and shutdown goes before the rest.
+        while ptzController.signals:
+            sig = 'shutdown' if 'shutdown' in ptzController.signals else ptzController.signals.popleft()
+
+            print('Received signal: %s' % sig)
+
+            if sig == 'shutdown':
                 ptzController.shutdown()
+                if args.pidfile:
+                    remove_pidfile(args.pidfile)
                 os._exit(0)
-            elif ptzController.SIGNAL == 'restart':
+            elif sig == 'reload':
+                ptzController.reload_config()
+            elif sig == 'restart':
                 ptzController.shutdown(restart=True)
-            elif ptzController.SIGNAL == 'checkout':
+            elif sig == 'checkout':
                 ptzController.shutdown(restart=True, checkout=True)
             else:
                 ptzController.shutdown(restart=True, update=True)
 
-            ptzController.SIGNAL = None
+
+def daemonize():
+    """
+    Detach from the terminal with the usual double fork. The working
+    directory is left unchanged so relative paths in the config still work.
+    """
+    try:
+        if os.fork() > 0:
+            os._exit(0)
+    except OSError as e:
+        sys.exit("1st fork failed: %s [%d]" % (e.strerror, e.errno))
+
+    os.setsid()
+
+    try:
+        if os.fork() > 0:
+            os._exit(0)
+    except OSError as e:
+        sys.exit("2nd fork failed: %s [%d]" % (e.strerror, e.errno))
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def write_pidfile(pidfile):
+    pid = os.getpid()
+    try:
+        with open(pidfile, 'w') as f:
+            f.write("%s\n" % pid)
+    except IOError as e:
+        sys.exit("Unable to write PID file: %s [%d]" % (e.strerror, e.errno))
+
+
+def remove_pidfile(pidfile):
+    try:
+        os.remove(pidfile)
+    except OSError:
+        pass
 
 
 # Call main()
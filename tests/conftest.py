@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import PTZController from the checkout, as start.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
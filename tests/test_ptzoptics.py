@@ -0,0 +1,119 @@
+import pytest
+
+from PTZController import ptzoptics
+
+
+def parse(query):
+    return ptzoptics.parse_ptzcmd(query.split('&'))
+
+
+@pytest.mark.parametrize('direction, pan, tilt', [
+    ('up', 0, 1),
+    ('down', 0, -1),
+    ('left', -1, 0),
+    ('right', 1, 0),
+    ('leftup', -1, 1),
+    ('rightup', 1, 1),
+    ('leftdown', -1, -1),
+    ('rightdown', 1, -1),
+])
+def test_directions(direction, pan, tilt):
+    command = parse(f'ptzcmd&{direction}&24&20')
+    assert command.velocity == (pan * 1.0, tilt * 1.0, None)
+
+
+def test_pantilt_speeds_are_scaled_and_clamped():
+    command = parse('ptzcmd&rightup&12&10')
+    assert command.pantilt == (0.5, 0.5)
+    command = parse('ptzcmd&leftup&99&0')
+    assert command.pantilt == (-1.0, 1 / ptzoptics.TILT_SPEED_MAX)
+
+
+def test_default_speeds():
+    command = parse('ptzcmd&up')
+    assert command.pantilt == (0, ptzoptics.DEFAULT_SPEEDS[1] / ptzoptics.TILT_SPEED_MAX)
+
+
+def test_combined_move_and_zoom():
+    command = parse('ptzcmd&right&12&10&zoomin&7')
+    assert command.velocity == (0.5, 0.0, 1.0)
+
+
+def test_zoom_only_leaves_pantilt_alone():
+    command = parse('ptzcmd&zoomout&7')
+    assert command.velocity == (None, None, -1.0)
+
+
+def test_stops():
+    command = parse('ptzcmd&ptzstop&zoomstop')
+    assert command.velocity is None
+    assert command.stop_pantilt and command.stop_zoom
+
+
+def test_move_with_zoom_stop():
+    command = parse('ptzcmd&left&24&20&zoomstop')
+    assert command.velocity == (-1.0, 0.0, 0)
+
+
+def test_focus():
+    assert parse('ptzcmd&focusin&7').focus == 1.0
+    assert parse('ptzcmd&focusout&7').focus == -1.0
+    assert parse('ptzcmd&focusstop').focus_stop
+
+
+def test_home():
+    assert parse('ptzcmd&home').home
+
+
+@pytest.mark.parametrize('name, action', [('poscall', 'call'), ('posset', 'set'), ('posclear', 'clear')])
+def test_presets_are_numbered_from_one(name, action):
+    assert parse(f'ptzcmd&{name}&1').presets == [(action, '0')]
+    assert parse(f'ptzcmd&{name}&10').presets == [(action, '9')]
+
+
+@pytest.mark.parametrize('query', ['ptzcmd&poscall', 'ptzcmd&poscall&0', 'ptzcmd&posset&-3', 'ptzcmd&posclear&x'])
+def test_invalid_presets_are_skipped(query):
+    assert parse(query).presets == []
+
+
+def test_absolute_position():
+    command = parse('ptzcmd&abs&24&20&0990&FAF0')
+    mode, position, speed = command.position
+    assert mode == 'absolute'
+    assert position == (1.0, -1.0, None)
+    assert speed == (1.0, 1.0, 1.0)
+
+
+def test_relative_position():
+    command = parse('ptzcmd&rel&12&10&0000&0288')
+    mode, position, speed = command.position
+    assert mode == 'relative'
+    assert position[0] == 0.0 and position[1] == pytest.approx(0.5, abs=0.001)
+    assert speed == (0.5, 0.5, 1.0)
+
+
+def test_invalid_position_is_skipped():
+    assert parse('ptzcmd&abs&24&20&zz&0000').position is None
+
+
+def test_zoomto():
+    command = parse('ptzcmd&zoomto&7&2000')
+    assert command.position == ('absolute', (None, None, 0.5), (1.0, 1.0, 1.0))
+
+
+def test_unknown_commands():
+    command = parse('ptzcmd&spin&right&12&10')
+    assert command.unknown == ['spin']
+    assert command.pantilt == (0.5, 0.0)
+
+
+def test_missing_arguments_do_not_swallow_the_next_command():
+    command = parse('ptzcmd&right&zoomin&7')
+    assert command.velocity[2] == 1.0
+
+
+def test_param():
+    assert ptzoptics.parse_param(['post_image_value', 'flip', '1']) == [('flip', True)]
+    assert ptzoptics.parse_param(['post_image_value', 'mirror', '0']) == [('mirror', False)]
+    assert ptzoptics.parse_param(['post_image_value', 'brightness', '5']) == []
+    assert ptzoptics.parse_param(['get_image_value', 'flip', '1']) == []
@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+import PTZController as package
+from PTZController.config import Config
+
+
+class FakeCamera(object):
+    """ Records the cameras built from the config instead of connecting to them """
+
+    def __init__(self, options, power=None, sessions=None):
+        self.id = options['id']
+        self.name = options['name']
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFederation(object):
+    def configure(self, nodes):
+        self.nodes = nodes
+
+
+def write_config(path, cameras):
+    text = '[General]\nconfig_watch_interval = 0\n'
+    for section, host in cameras.items():
+        text += f'\n[{section}]\nhost = {host}\nport = 80\n'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    """ A PTZController with only the state that reload_config uses """
+    monkeypatch.setattr(package, 'Camera', FakeCamera)
+    config_file = tmp_path / 'PTZController.conf'
+    write_config(config_file, {'Stage': '10.0.0.1', 'Pulpit': '10.0.0.2', 'Choir': '10.0.0.3'})
+
+    controller = object.__new__(package.PTZController)
+    controller.CONFIG = Config(str(config_file))
+    controller._reload_lock = threading.RLock()
+    controller.workers = None
+    controller.power = None
+    controller.sessions = None
+    controller.federation = FakeFederation()
+    controller._cameras = []
+    controller._camera_ids = {}
+    controller._camera_options = {}
+    controller._next_camera_id = 1
+    for section, options in controller.camera_sections().items():
+        controller._cameras.append(controller._start_camera(section, options))
+    return controller
+
+
+def ids(controller):
+    return {camera.name: camera.id for camera in controller.local_cameras}
+
+
+def test_ids_survive_reloads(controller):
+    before = ids(controller)
+    assert before == {'Stage': 1, 'Pulpit': 2, 'Choir': 3}
+
+    write_config(controller.CONFIG.config_file, {'Choir': '10.0.0.3', 'Stage': '10.0.0.9', 'Pulpit': '10.0.0.2'})
+    result = controller.reload_config()
+    assert result == {'added': [], 'changed': ['Stage'], 'removed': []}
+    assert ids(controller) == before
+
+
+def test_removed_ids_are_not_reused(controller):
+    write_config(controller.CONFIG.config_file, {'Stage': '10.0.0.1', 'Choir': '10.0.0.3'})
+    result = controller.reload_config()
+    assert result['removed'] == ['Pulpit']
+
+    write_config(controller.CONFIG.config_file, {'Stage': '10.0.0.1', 'Choir': '10.0.0.3', 'Balcony': '10.0.0.4'})
+    result = controller.reload_config()
+    assert result['added'] == ['Balcony']
+    assert ids(controller) == {'Stage': 1, 'Choir': 3, 'Balcony': 4}
+
+    # A camera that comes back gets its old ID
+    write_config(controller.CONFIG.config_file, {'Stage': '10.0.0.1', 'Choir': '10.0.0.3', 'Balcony': '10.0.0.4',
+                                                 'Pulpit': '10.0.0.2'})
+    controller.reload_config()
+    assert ids(controller) == {'Stage': 1, 'Pulpit': 2, 'Choir': 3, 'Balcony': 4}
+
+
+def test_only_changed_cameras_are_rebuilt(controller):
+    old = {camera.name: camera for camera in controller.local_cameras}
+
+    write_config(controller.CONFIG.config_file, {'Stage': '10.0.0.1', 'Pulpit': '10.0.0.8'})
+    controller.reload_config()
+    new = {camera.name: camera for camera in controller.local_cameras}
+
+    assert new['Stage'] is old['Stage'] and not old['Stage'].closed
+    assert new['Pulpit'] is not old['Pulpit'] and old['Pulpit'].closed
+    assert new['Pulpit'].options['host'] == '10.0.0.8'
+    assert 'Choir' not in new and old['Choir'].closed
+
+
+def test_invalid_config_keeps_the_cameras(controller):
+    cameras = controller.local_cameras
+    write_config(controller.CONFIG.config_file, {'Stage': '10.0.0.9'})
+    with open(controller.CONFIG.config_file, 'a', encoding='utf-8') as f:
+        f.write('[Broken\n')
+    assert controller.reload_config() is None
+    assert controller.local_cameras == cameras